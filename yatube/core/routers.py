@@ -0,0 +1,19 @@
+CACHE_APP_LABEL = 'django_cache'
+
+
+class CacheRouter:
+    """Отправляет таблицу DatabaseCache в отдельную базу 'cache'.
+
+    Так запросы кэша не ждут блокировок записи основной базы SQLite
+    и не попадают в бюджет запросов страницы.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return 'cache'
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, **hints):
+        return (db == 'cache') == (app_label == CACHE_APP_LABEL)
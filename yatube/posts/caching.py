@@ -0,0 +1,123 @@
+import time
+from functools import wraps
+from hashlib import md5
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import (
+    get_cache_key, learn_cache_key, patch_vary_headers
+)
+
+
+def _fresh_version():
+    # Версия, вытесненная из кэша, не должна начаться заново с единицы:
+    # иначе оживут страницы, сохранённые под старым номером.
+    return int(time.time() * 1000)
+
+
+def _version_key(scope):
+    # Слаги и имена пользователей бывают не-ASCII, а memcached такого
+    # в ключах не принимает.
+    return f'version:{quote(scope)}'
+
+
+def versions(*scopes):
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = {key: _fresh_version() for key in keys if key not in found}
+    cache.set_many(missing, None)
+    found.update(missing)
+    return [found[key] for key in keys]
+
+
+def bump(*scopes):
+    """Инвалидирует все страницы, закэшированные под этими областями."""
+    for scope in set(scopes):
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _fresh_version(), None)
+
+
+def card_scopes(post):
+    scopes = [f'post:{post.pk}', f'user:{post.author_id}']
+    if post.group_id is not None:
+        scopes.append(f'group-id:{post.group_id}')
+    return scopes
+
+
+class CardBatch:
+    """Ключи и уже отрендеренные карточки постов одной страницы.
+
+    Ключ карточки включает версии поста, его автора и группы, поэтому
+    правка любого из них даёт новый ключ, а старая запись просто
+    истекает.
+    """
+
+    def __init__(self, posts, fragment):
+        posts = list(posts)
+        scopes = [card_scopes(post) for post in posts]
+        found = iter(versions(*(scope for group in scopes for scope in group)))
+        self.keys = {}
+        for post, group in zip(posts, scopes):
+            numbers = '.'.join(str(next(found)) for _ in group)
+            self.keys[post.pk] = f'card:{fragment}:{post.pk}:{numbers}'
+        self.found = cache.get_many(list(self.keys.values()))
+
+    def get(self, post):
+        return self.found.get(self.keys.get(post.pk))
+
+    def set(self, post, html):
+        if post.pk in self.keys:
+            cache.set(self.keys[post.pk], html, settings.CARD_CACHE_TIMEOUT)
+
+
+def etag(request, *scopes):
+    """ETag страницы из версий её областей, без чтения постов.
+
+    Разметка зависит от пользователя и от курсора страницы, поэтому
+    они тоже входят в тег.
+    """
+    raw = '|'.join(map(str, (
+        *versions(*scopes), request.user.pk, request.GET.urlencode())))
+    return md5(raw.encode()).hexdigest()
+
+
+def scope_etag(*scopes):
+    """etag_func для condition() по шаблонам областей с аргументами URL."""
+    def etag_func(request, *args, **kwargs):
+        return etag(request, *(scope.format(**kwargs) for scope in scopes))
+    return etag_func
+
+
+def versioned_cache_page(timeout, *scopes):
+    """Кэш страницы, ключ которого включает версии областей.
+
+    Области задаются шаблонами строк с аргументами URL, например
+    ``'group:{slug}'``. Сигналы моделей повышают версии, поэтому
+    страница живёт долго и при этом сразу отражает изменения.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            prefix = 'page.' + '.'.join(map(str, versions(
+                *(scope.format(**kwargs) for scope in scopes))))
+            cache_key = get_cache_key(request, prefix, 'GET', cache=cache)
+            response = cache.get(cache_key) if cache_key else None
+            if response is not None:
+                return response
+            response = view(request, *args, **kwargs)
+            if getattr(request, 'session', None) and request.session.accessed:
+                # SessionMiddleware добавит Vary: Cookie уже после нас.
+                patch_vary_headers(response, ('Cookie',))
+            if response.status_code == 200 and not response.cookies:
+                cache_key = learn_cache_key(
+                    request, response, timeout, prefix, cache=cache)
+                cache.set(cache_key, response, timeout)
+            return response
+        return wrapper
+    return decorator
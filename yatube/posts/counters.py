@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import AuthorStats, Comment, Follow, Group, Post, StoredImage
+
+User = get_user_model()
+
+
+def _shift(queryset, **deltas):
+    # Уменьшаем только положительные значения: PositiveIntegerField
+    # не переживёт ухода в минус, а дрейф починит repair_counters.
+    for field, delta in deltas.items():
+        rows = queryset
+        if delta < 0:
+            rows = rows.filter(**{f'{field}__gte': -delta})
+        rows.update(**{field: F(field) + delta})
+
+
+def shift_author(user_id, **deltas):
+    if any(delta > 0 for delta in deltas.values()):
+        AuthorStats.objects.get_or_create(user_id=user_id)
+    _shift(AuthorStats.objects.filter(user_id=user_id), **deltas)
+
+
+def shift_group(group_id, delta):
+    if group_id is not None:
+        _shift(Group.objects.filter(pk=group_id), posts_count=delta)
+
+
+def shift_comments(post_id, delta):
+    _shift(Post.objects.filter(pk=post_id), comments_count=delta)
+
+
+def shift_image(name, delta):
+    if delta > 0:
+        StoredImage.objects.get_or_create(name=name)
+    _shift(StoredImage.objects.filter(name=name), refs=delta)
+
+
+def author_stats(user):
+    """Счётчики пользователя без лишнего COUNT; пустые, если строки нет."""
+    try:
+        return user.stats
+    except AuthorStats.DoesNotExist:
+        return AuthorStats(user=user)
+
+
+def _count(queryset, field, key='pk'):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef(key)}).order_by().values(
+            field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+@transaction.atomic
+def repair():
+    """Пересчитывает все счётчики; возвращает число исправленных строк."""
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=pk) for pk in User.objects.filter(
+            stats__isnull=True).values_list('pk', flat=True).iterator()],
+        ignore_conflicts=True,
+    )
+    StoredImage.objects.bulk_create(
+        [StoredImage(name=name) for name in Post.objects.exclude(
+            image='').exclude(image__in=StoredImage.objects.values('name')
+                              ).values_list('image', flat=True).distinct()],
+        ignore_conflicts=True,
+    )
+    targets = (
+        (Group.objects.all(), 'posts_count', _count(Post.objects, 'group')),
+        (Post.objects.all(), 'comments_count',
+         _count(Comment.objects, 'post')),
+        (AuthorStats.objects.all(), 'posts_count',
+         _count(Post.objects, 'author')),
+        (AuthorStats.objects.all(), 'followers_count',
+         _count(Follow.objects, 'author')),
+        (AuthorStats.objects.all(), 'following_count',
+         _count(Follow.objects, 'user')),
+        (StoredImage.objects.all(), 'refs',
+         _count(Post.objects, 'image', 'name')),
+    )
+    fixed = {}
+    for queryset, field, actual in targets:
+        drifted = queryset.annotate(actual=actual).exclude(
+            **{field: F('actual')}).values('pk')
+        label = f'{queryset.model._meta.model_name}.{field}'
+        fixed[label] = queryset.filter(pk__in=drifted).update(
+            **{field: actual})
+    return fixed
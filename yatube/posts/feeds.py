@@ -0,0 +1,242 @@
+import heapq
+from itertools import dropwhile, islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F, Sum, Window
+from django.db.models.functions import RowNumber
+
+from .models import AuthorStats, Follow, Post, Timeline
+from .utils import CursorPaginator, InvalidCursor, page_context
+
+
+def _entries(user_ids, posts):
+    return (
+        Timeline(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        for user_id in user_ids
+        for post_id, pub_date in posts
+    )
+
+
+def _bulk_insert(entries):
+    # bulk_create сам превращает генератор в список, поэтому режем на пачки
+    # заранее: у автора могут быть сотни тысяч подписчиков.
+    entries = iter(entries)
+    batch = list(islice(entries, settings.TIMELINE_BATCH_SIZE))
+    while batch:
+        Timeline.objects.bulk_create(batch, ignore_conflicts=True)
+        batch = list(islice(entries, settings.TIMELINE_BATCH_SIZE))
+
+
+def push_post(post):
+    """Разносит новый пост по лентам всех подписчиков автора."""
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    _bulk_insert(_entries(followers.iterator(), [(post.pk, post.pub_date)]))
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика уже опубликованные посты автора."""
+    posts = Post.objects.filter(
+        author_id=author_id
+    ).values_list('pk', 'pub_date')
+    _bulk_insert(_entries([user_id], posts.iterator()))
+
+
+def prune(user_id, author_id):
+    """Убирает посты автора из ленты бывшего подписчика."""
+    Timeline.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+@transaction.atomic
+def rebuild(batch_size=None):
+    """Собирает все ленты заново из подписок; возвращает число записей.
+
+    Для массовых загрузок, где сигналы не срабатывают: подписки идут
+    пачками по pk, каждая пачка - один INSERT ... SELECT. Всё в одной
+    транзакции, так что читатели не видят пустых лент.
+    """
+    batch_size = batch_size or settings.TIMELINE_BATCH_SIZE
+    Timeline.objects.all().delete()
+    insert = (
+        f'INSERT INTO {Timeline._meta.db_table} (user_id, post_id, pub_date) '
+        f'SELECT follow.user_id, post.id, post.pub_date '
+        f'FROM {Follow._meta.db_table} follow '
+        f'JOIN {Post._meta.db_table} post '
+        f'ON post.author_id = follow.author_id '
+        f'WHERE follow.id > %s AND follow.id <= %s'
+    )
+    pks = Follow.objects.order_by('pk').values_list(
+        'pk', flat=True).iterator(chunk_size=batch_size)
+    start = 0
+    with connection.cursor() as cursor:
+        batch = list(islice(pks, batch_size))
+        while batch:
+            cursor.execute(insert, [start, batch[-1]])
+            start = batch[-1]
+            batch = list(islice(pks, batch_size))
+    return Timeline.objects.count()
+
+
+def followed_posts_count(user):
+    """Размер ленты подписок по счётчикам авторов, без COUNT по ленте."""
+    return AuthorStats.objects.filter(
+        user__following__user=user
+    ).aggregate(total=Sum('posts_count'))['total'] or 0
+
+
+def timeline_page_context(request):
+    entries = Timeline.objects.filter(
+        user=request.user
+    ).select_related('post__author', 'post__group').defer('post__text')
+    context = page_context(
+        request, entries, count=followed_posts_count(request.user))
+    page_obj = context['page_obj']
+    page_obj.object_list = [entry.post for entry in page_obj.object_list]
+    return context
+
+
+def _recent_key(author_id):
+    return f'feeds:recent:{author_id}'
+
+
+def remember_post(post):
+    """Добавляет пост в голову закэшированного списка автора."""
+    key = _recent_key(post.author_id)
+    recent = cache.get(key)
+    if recent is not None:
+        recent.insert(0, (post.pub_date, post.pk))
+        cache.set(key, recent[:settings.FEED_RECENT_POSTS], None)
+
+
+def forget_authors(*author_ids):
+    cache.delete_many([_recent_key(author_id) for author_id in author_ids])
+
+
+def _load_recent(author_ids):
+    """{автор: [(pub_date, id), ...]} одним запросом на пачку авторов.
+
+    Номер поста внутри автора считает оконная функция, а отсекает
+    лишние внешний запрос: фильтровать по окну ORM не умеет.
+    """
+    lists = {author_id: [] for author_id in author_ids}
+    ids = iter(lists)
+    batch = list(islice(ids, settings.TIMELINE_BATCH_SIZE))
+    while batch:
+        ranked = Post.objects.filter(author_id__in=batch).annotate(
+            position=Window(
+                RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=[F('pub_date').desc(), F('pk').desc()],
+            )
+        ).values('pk', 'author_id', 'pub_date', 'position')
+        sql, params = ranked.query.sql_with_params()
+        for post in Post.objects.raw(
+                f'SELECT * FROM ({sql}) WHERE position <= %s '
+                f'ORDER BY pub_date DESC, id DESC',
+                [*params, settings.FEED_RECENT_POSTS]):
+            lists[post.author_id].append((post.pub_date, post.pk))
+        batch = list(islice(ids, settings.TIMELINE_BATCH_SIZE))
+    return lists
+
+
+def recent_posts(author_ids):
+    """Ограниченные списки (pub_date, id) свежих постов авторов.
+
+    Списки отсортированы по убыванию и живут в кэше; промахи
+    достраиваются из базы одним запросом.
+    """
+    keys = {_recent_key(author_id): author_id for author_id in author_ids}
+    lists = cache.get_many(keys)
+    missing = {
+        _recent_key(author_id): recent
+        for author_id, recent in _load_recent(
+            [author_id for key, author_id in keys.items()
+             if key not in lists]).items()
+    }
+    cache.set_many(missing, None)
+    lists.update(missing)
+    return list(lists.values())
+
+
+def _merge_after(lists, cursor, per_page):
+    merged = heapq.merge(*lists, reverse=True)
+    if cursor is not None:
+        merged = dropwhile(lambda row: row >= cursor[:2], merged)
+    rows = list(islice(merged, per_page + 1))
+    number = cursor[2] + 1 if cursor else 1
+    return rows, number, cursor is not None, len(rows) > per_page
+
+
+def _merge_before(lists, cursor, per_page):
+    newer = heapq.merge(
+        *[[row for row in rows if row > cursor[:2]] for rows in lists],
+        reverse=True,
+    )
+    rows = list(newer)[-(per_page + 1):]
+    has_previous = len(rows) > per_page
+    number = max(cursor[2] - 1, 2) if has_previous else 1
+    return rows[-per_page:], number, has_previous, True
+
+
+def merged_page_context(request):
+    """Лента подписок слиянием списков авторов (fan-out on read).
+
+    Стоимость страницы ограничена её размером: k-way слияние
+    закэшированных списков и один in_bulk за телами постов. Если
+    страница уходит глубже, чем хранят списки, читаем её из базы.
+    """
+    count = followed_posts_count(request.user)
+    paginator = CursorPaginator(
+        Post.objects.select_related('author', 'group').filter(
+            author__following__user=request.user).defer('text'),
+        settings.PAGINATOR_POST_COUNT,
+        count=count,
+    )
+    before = request.GET.get('before')
+    token = before or request.GET.get('after')
+    try:
+        cursor = paginator.decode_cursor(token) if token else None
+    except InvalidCursor:
+        cursor = before = None
+    if cursor is None and request.GET.get('page'):
+        return page_context(request, paginator.object_list, count=count)
+    lists = recent_posts(Follow.objects.filter(
+        user=request.user).values_list('author_id', flat=True))
+    merge = _merge_before if before else _merge_after
+    rows, number, has_previous, has_next = merge(
+        lists, cursor, paginator.per_page)
+    if not _within_horizon(lists, rows, cursor, before, paginator.per_page):
+        return page_context(request, paginator.object_list, count=count)
+    rows = rows[:paginator.per_page]
+    posts = paginator.object_list.in_bulk([pk for _, pk in rows])
+    page_obj = paginator._get_page(
+        [posts[pk] for _, pk in rows if pk in posts], number, paginator)
+    return {
+        'page_obj': paginator._with_cursors(page_obj, has_previous, has_next)
+    }
+
+
+def _within_horizon(lists, rows, cursor, before, per_page):
+    # Обрезанный список автора полон только до своего последнего
+    # элемента: всё, что старше, могло в него не поместиться.
+    horizon = max(
+        (recent[-1] for recent in lists
+         if len(recent) >= settings.FEED_RECENT_POSTS),
+        default=None,
+    )
+    if horizon is None:
+        return True
+    if before:
+        return cursor[:2] >= horizon
+    return len(rows) > per_page and rows[-1] >= horizon
+
+
+def follow_page_context(request):
+    if settings.FOLLOW_FEED == 'merge':
+        return merged_page_context(request)
+    return timeline_page_context(request)
@@ -0,0 +1,273 @@
+"""Заранее нарезанные варианты картинок постов.
+
+При сохранении поста с новой картинкой в ImageVariant сразу пишутся
+записи о вариантах из POST_IMAGE_VARIANTS: имя файла и размер известны
+заранее, потому что картинка обрезается точно под размер варианта. Сами
+файлы рендерятся после коммита в пуле фоновых потоков, которые в базу
+не ходят. Шаблоны берут готовые адреса, так что в запросе картинки
+не обрабатываются.
+"""
+import base64
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from . import counters
+from .models import ImageVariant, Post, StoredImage
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+
+
+def source_storage():
+    return Post._meta.get_field('image').storage
+
+
+def variant_name(source, alias):
+    stem = os.path.splitext(source)[0]
+    return f'variants/{alias}/{stem}.jpg'
+
+
+def attach_variants(posts):
+    """Подставляет постам страницы их нарезки одним запросом.
+
+    Заполняет кэш свойства Post.image_variants, чтобы шаблон
+    не спрашивал базу на каждый пост.
+    """
+    posts = [post for post in posts if post.image]
+    variants = {}
+    if posts:
+        for variant in ImageVariant.objects.filter(
+                source__in={post.image.name for post in posts}):
+            variants.setdefault(variant.source, {})[variant.alias] = variant
+    for post in posts:
+        post.__dict__['image_variants'] = variants.get(post.image.name, {})
+
+
+def ingest_format():
+    """Первый из POST_IMAGE_FORMATS, который умеет сохранять Pillow."""
+    Image.init()
+    return next(
+        fmt for fmt in settings.POST_IMAGE_FORMATS if fmt in Image.SAVE)
+
+
+def normalize(upload):
+    """Приводит загрузку к POST_IMAGE_MAX_SIDE и формату хранения.
+
+    Размер проверяется по заголовку, до декодирования. JPEG уменьшается
+    ещё при декодировании (draft), остальное - через reduce внутри
+    thumbnail. Метаданные при перекодировании не переносятся.
+    """
+    upload.seek(0)
+    try:
+        image = Image.open(upload)
+        if image.width * image.height > settings.POST_IMAGE_MAX_PIXELS:
+            raise ValidationError(
+                'Картинка слишком большая: %(width)s×%(height)s',
+                code='too_large',
+                params={'width': image.width, 'height': image.height},
+            )
+        content, fmt = _reencode(image)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # verify() ImageField читает только заголовок, поэтому обрезанный
+        # файл доходит сюда и ломается уже при декодировании.
+        raise ValidationError(
+            'Не удалось прочитать картинку', code='invalid_image')
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    extension = EXTENSIONS.get(fmt, f'.{fmt.lower()}')
+    return ContentFile(content, name=stem + extension)
+
+
+def _reencode(image):
+    """Байты картинки в формате хранения и сам формат."""
+    side = settings.POST_IMAGE_MAX_SIDE
+    image.draft('RGB', (side, side))
+    image = ImageOps.exif_transpose(image)
+    fmt = ingest_format()
+    alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+    image = image.convert('RGBA' if alpha else 'RGB')
+    image.thumbnail((side, side), Image.LANCZOS, reducing_gap=3.0)
+    if alpha and fmt == 'JPEG':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, fmt, quality=settings.POST_IMAGE_QUALITY)
+    return buffer.getvalue(), fmt
+
+
+def register(source):
+    """Записывает в базу варианты картинки, которые будут нарезаны."""
+    ImageVariant.objects.filter(source=source).delete()
+    ImageVariant.objects.bulk_create(
+        ImageVariant(source=source, alias=alias,
+                     name=variant_name(source, alias),
+                     width=width, height=height)
+        for alias, (width, height) in settings.POST_IMAGE_VARIANTS.items()
+    )
+
+
+def fit(source, size):
+    """JPEG-байты картинки, обрезанной по центру точно под size."""
+    with source_storage().open(source) as file:
+        image = Image.open(file)
+        image.draft('RGB', size)
+        image = ImageOps.exif_transpose(image)
+        image = ImageOps.fit(image.convert('RGB'), size, Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG',
+               quality=settings.POST_IMAGE_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def placeholder(file):
+    """Размытое превью картинки (LQIP) как data URI на пару сотен байт."""
+    size = settings.POST_IMAGE_PLACEHOLDER_SIZE
+    file.seek(0)
+    image = Image.open(file)
+    image.draft('RGB', size)
+    image = ImageOps.exif_transpose(image)
+    image = ImageOps.fit(image.convert('RGB'), size, Image.BILINEAR)
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=40)
+    file.seek(0)
+    return 'data:image/jpeg;base64,' + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+def stored_placeholder(source):
+    """Заглушка для уже сохранённого файла; пустая, если его не прочесть."""
+    try:
+        with source_storage().open(source) as file:
+            return placeholder(file)
+    except (OSError, SuspiciousFileOperation):
+        logger.warning('Не удалось прочитать картинку %s', source)
+        return ''
+
+
+def placeholder_for(image):
+    """Заглушка для картинки поста, ещё не сохранённой или уже в хранилище."""
+    if image._committed:
+        return stored_placeholder(image.name)
+    try:
+        return placeholder(image)
+    except OSError:
+        logger.warning('Не удалось прочитать загрузку %s', image.name)
+        return ''
+
+
+def render(source, alias):
+    """Рендерит вариант в хранилище; в базу не ходит."""
+    content = fit(source, settings.POST_IMAGE_VARIANTS[alias])
+    name = variant_name(source, alias)
+    default_storage.delete(name)
+    default_storage.save(name, ContentFile(content))
+
+
+def render_all(source):
+    """Нарезает все варианты; ошибки пишет в лог и возвращает False."""
+    try:
+        for alias in settings.POST_IMAGE_VARIANTS:
+            render(source, alias)
+    except Exception:
+        logger.exception('Не удалось нарезать картинку %s', source)
+        return False
+    return True
+
+
+def build(source):
+    """Нарезает варианты и записывает их в базу, только если всё вышло.
+
+    Иначе строки вариантов убираются: шаблон тогда возьмёт ресайз по
+    подписанной ссылке, а не сошлётся на несуществующий файл.
+    """
+    if render_all(source):
+        register(source)
+    else:
+        ImageVariant.objects.filter(source=source).delete()
+
+
+def missing(sources):
+    """Картинки, у которых нет какого-то варианта нужного размера."""
+    expected = {
+        (alias, width, height)
+        for alias, (width, height) in settings.POST_IMAGE_VARIANTS.items()
+    }
+    found = {}
+    for variant in ImageVariant.objects.filter(source__in=sources):
+        if default_storage.exists(variant.name):
+            found.setdefault(variant.source, set()).add(
+                (variant.alias, variant.width, variant.height))
+    return [source for source in sources
+            if not expected <= found.get(source, set())]
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(
+            max_workers=settings.POST_IMAGE_WORKERS,
+            thread_name_prefix='post-images',
+        )
+    return _pool
+
+
+def schedule(source):
+    """Нарезает варианты после фиксации транзакции.
+
+    Повторно загруженный файл уже нарезан, его пропускаем. Пока нарезка
+    не готова, строк вариантов нет и шаблон ресайзит картинку по ссылке.
+    """
+    if not missing([source]):
+        return
+    if settings.POST_IMAGE_WORKERS:
+        transaction.on_commit(lambda: _executor().submit(build, source))
+    else:
+        transaction.on_commit(lambda: build(source))
+
+
+def _delete_file(storage, name):
+    try:
+        storage.delete(name)
+    except (OSError, SuspiciousFileOperation):
+        logger.warning('Не удалось удалить файл %s', name, exc_info=True)
+
+
+def collect(name):
+    """Удаляет файл и его нарезки, если на файл больше не ссылаются.
+
+    Ссылку могли взять заново уже после release, поэтому счётчик
+    проверяется под блокировкой строки, которая держится до удаления
+    файлов.
+    """
+    with transaction.atomic():
+        stored = StoredImage.objects.select_for_update().filter(
+            name=name, refs=0).first()
+        if stored is None:
+            return
+        stored.delete()
+        variants = ImageVariant.objects.filter(source=name)
+        for variant in variants.values_list('name', flat=True):
+            _delete_file(default_storage, variant)
+        variants.delete()
+        _delete_file(source_storage(), name)
+
+
+def acquire(name):
+    counters.shift_image(name, 1)
+
+
+def release(name):
+    counters.shift_image(name, -1)
+    transaction.on_commit(lambda: collect(name))
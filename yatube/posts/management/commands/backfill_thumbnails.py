@@ -0,0 +1,115 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.core.management.base import BaseCommand
+
+from posts import images
+from posts.models import Post
+
+
+def init_worker(niceness):
+    django.setup()
+    os.nice(niceness)
+
+
+class Command(BaseCommand):
+    help = ('Нарезает недостающие варианты и заглушки картинок постов '
+            'в пуле процессов')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=max(os.cpu_count() // 2, 1))
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--checkpoint',
+            help='файл с id последнего обработанного поста; '
+                 'если он есть, проход продолжается с этого места')
+        parser.add_argument(
+            '--max-rate', type=float, default=0,
+            help='не больше стольких картинок в секунду')
+        parser.add_argument(
+            '--niceness', type=int, default=10,
+            help='приоритет процессов пула относительно сайта')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='перенарезать и готовые варианты')
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        start = self.read_checkpoint(checkpoint)
+        if start:
+            self.stdout.write(f'Продолжаем с поста {start}')
+        rows = Post.objects.exclude(image='').filter(
+            pk__gt=start
+        ).order_by('pk').values_list(
+            'pk', 'image', 'image_placeholder'
+        ).iterator(chunk_size=options['batch_size'])
+        rendered = failed = 0
+        started = time.monotonic()
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            initializer=init_worker,
+            initargs=(options['niceness'],),
+        ) as pool:
+            batch = list(islice(rows, options['batch_size']))
+            while batch:
+                done, errors = self.render(pool, batch, options['force'])
+                rendered += done
+                failed += errors
+                self.fill_placeholders(pool, batch)
+                self.write_checkpoint(checkpoint, batch[-1][0])
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Пост {batch[-1][0]}: нарезано {rendered}, '
+                    f'ошибок {failed}, {rendered / elapsed:.1f} картинок/с')
+                if options['max_rate']:
+                    time.sleep(max(
+                        rendered / options['max_rate'] - elapsed, 0))
+                batch = list(islice(rows, options['batch_size']))
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: нарезано {rendered}, ошибок {failed}'))
+
+    @staticmethod
+    def render(pool, batch, force):
+        sources = list(dict.fromkeys(image for _, image, _ in batch))
+        if not force:
+            sources = images.missing(sources)
+        rendered = failed = 0
+        for source, ok in zip(sources, pool.map(images.render_all, sources)):
+            if ok:
+                images.register(source)
+                rendered += 1
+            else:
+                failed += 1
+        return rendered, failed
+
+    @staticmethod
+    def fill_placeholders(pool, batch):
+        sources = list(dict.fromkeys(
+            image for _, image, placeholder in batch if not placeholder))
+        for source, placeholder in zip(
+                sources, pool.map(images.stored_placeholder, sources)):
+            if placeholder:
+                Post.objects.filter(
+                    pk__in=[pk for pk, image, _ in batch if image == source]
+                ).update(image_placeholder=placeholder)
+
+    @staticmethod
+    def read_checkpoint(path):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as file:
+            return int(file.read().strip() or 0)
+
+    @staticmethod
+    def write_checkpoint(path, pk):
+        if not path:
+            return
+        with open(f'{path}.tmp', 'w') as file:
+            file.write(str(pk))
+        os.replace(f'{path}.tmp', path)
@@ -0,0 +1,209 @@
+import json
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.signals import post_init
+from django.template.backends.django import Template
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import queries
+from posts.models import AuthorStats, Group, Post
+
+METRICS = ('time_ms', 'queries', 'rows', 'render_ms')
+
+
+class Counter:
+    value = 0
+
+    def add(self, amount=1):
+        self.value += amount
+
+
+@contextmanager
+def counting_rows():
+    """Считает созданные экземпляры моделей, то есть прочитанные строки."""
+    counter = Counter()
+
+    def count(sender, **kwargs):
+        counter.add()
+
+    post_init.connect(count, weak=False)
+    try:
+        yield counter
+    finally:
+        post_init.disconnect(count)
+
+
+@contextmanager
+def timing_templates():
+    """Суммарное время рендера шаблонов верхнего уровня, в секундах.
+
+    include рендерятся внутри них движком и отдельно не считаются.
+    """
+    counter = Counter()
+    original = Template.render
+
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            counter.add(time.perf_counter() - started)
+
+    Template.render = render
+    try:
+        yield counter
+    finally:
+        Template.render = original
+
+
+@contextmanager
+def rolled_back():
+    """Запись из замера не должна остаться в базе."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def scenarios():
+    """[(имя, пользователь, метод, адрес, данные)] для замера.
+
+    Берутся самые тяжёлые объекты базы: крупнейшие группа и автор, самый
+    обсуждаемый пост и читатель с наибольшим числом подписок.
+    """
+    group = Group.objects.order_by('-posts_count').first()
+    author = AuthorStats.objects.select_related('user').order_by(
+        '-posts_count').first()
+    reader = AuthorStats.objects.select_related('user').order_by(
+        '-following_count').first()
+    post = Post.objects.order_by('-comments_count').first()
+    if None in (group, author, reader, post):
+        raise CommandError('В базе нет данных, сначала запустите seed')
+    return [
+        ('index', None, 'get', reverse('posts:index'), None),
+        ('group_posts', None, 'get',
+         reverse('posts:group_posts', args=[group.slug]), None),
+        ('profile', None, 'get',
+         reverse('posts:profile', args=[author.user.username]), None),
+        ('post_detail', None, 'get',
+         reverse('posts:post_detail', args=[post.pk]), None),
+        ('follow_index', reader.user, 'get',
+         reverse('posts:follow_index'), None),
+        ('post_create', reader.user, 'post', reverse('posts:post_create'),
+         {'text': 'Пост из замера', 'group': group.pk}),
+        ('add_comment', reader.user, 'post',
+         reverse('posts:add_comment', args=[post.pk]),
+         {'text': 'Комментарий из замера'}),
+    ]
+
+
+def regressions(baseline, results, threshold, min_delta_ms):
+    """[(вид, метрика, было, стало)] там, где стало хуже порога."""
+    found = []
+    for view, metrics in results.items():
+        before = baseline.get(view, {})
+        for metric, value in metrics.items():
+            old = before.get(metric)
+            if old is None:
+                continue
+            floor = min_delta_ms if metric.endswith('_ms') else 0
+            if value > old * (1 + threshold) and value - old > floor:
+                found.append((view, metric, old, value))
+    return found
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время, запросы, прочитанные строки и рендер шаблонов '
+            'основных страниц и сравнивает их с сохранённым эталоном')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--warmup', type=int, default=1)
+        parser.add_argument(
+            '--warm-cache', action='store_true',
+            help='не чистить кэш перед запросами на чтение; после '
+                 'записи кэш чистится всегда')
+        parser.add_argument('--save', help='записать результат в JSON')
+        parser.add_argument(
+            '--compare', help='JSON эталона; ухудшение - ошибка')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='допустимое ухудшение метрики, доля')
+        parser.add_argument(
+            '--min-delta-ms', type=float, default=5.0,
+            help='меньшая разница во времени считается шумом')
+        parser.add_argument('--views', nargs='*', help='только эти виды')
+
+    def handle(self, *args, **options):
+        results = {}
+        for name, user, method, url, data in scenarios():
+            if options['views'] and name not in options['views']:
+                continue
+            results[name] = self.run(user, method, url, data, options)
+            self.stdout.write(name + ': ' + ', '.join(
+                f'{metric} {results[name][metric]:g}' for metric in METRICS))
+        if options['save']:
+            with open(options['save'], 'w') as file:
+                json.dump({
+                    'created': timezone.now().isoformat(),
+                    'posts': Post.objects.count(),
+                    'views': results,
+                }, file, indent=2, ensure_ascii=False)
+        if options['compare']:
+            self.compare(options, results)
+
+    def run(self, user, method, url, data, options):
+        """Медианы метрик по --repeat запросам после --warmup прогревочных."""
+        # С адреса не из INTERNAL_IPS debug toolbar не встраивается в ответ.
+        client = Client(REMOTE_ADDR='192.0.2.1')
+        if user is not None:
+            client.force_login(user)
+        samples = []
+        for attempt in range(options['warmup'] + options['repeat']):
+            if not options['warm_cache']:
+                cache.clear()
+            sample = self.measure(client, method, url, data)
+            if method != 'get':
+                # Откат базы не откатывает кэш: в нём остались бы версии
+                # и списки лент с постами, которых уже нет.
+                cache.clear()
+            if attempt >= options['warmup']:
+                samples.append(sample)
+        return {
+            metric: round(statistics.median(
+                sample[metric] for sample in samples), 2)
+            for metric in METRICS
+        }
+
+    @staticmethod
+    def measure(client, method, url, data):
+        with rolled_back(), queries.recording() as recorder, \
+                counting_rows() as rows, timing_templates() as render:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data)
+            elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise CommandError(f'{url}: ответ {response.status_code}')
+        return {
+            'time_ms': elapsed * 1000,
+            'queries': len(recorder),
+            'rows': rows.value,
+            'render_ms': render.value * 1000,
+        }
+
+    def compare(self, options, results):
+        with open(options['compare']) as file:
+            baseline = json.load(file)['views']
+        found = regressions(baseline, results, options['threshold'],
+                            options['min_delta_ms'])
+        for view, metric, old, new in found:
+            self.stderr.write(f'{view}.{metric}: {old:g} -> {new:g}')
+        if found:
+            raise CommandError(f'Ухудшений метрик: {len(found)}')
+        self.stdout.write(self.style.SUCCESS('Ухудшений нет'))
@@ -0,0 +1,78 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import AuthorStats, Comment, Group, Post, Timeline
+from posts.utils import CursorPaginator
+
+User = get_user_model()
+
+WARNINGS = (
+    (re.compile(r'\bSCAN\b(?!.*\bINDEX\b)'), 'полный просмотр таблицы'),
+    (re.compile(r'TEMP B-TREE'), 'сортировка во временном B-tree'),
+)
+
+
+def feed_page(queryset, cursor_from=None):
+    """Запрос страницы ленты в том виде, в каком его строит пагинатор."""
+    paginator = CursorPaginator(queryset, settings.PAGINATOR_POST_COUNT)
+    rows = paginator.object_list
+    if cursor_from is not None:
+        rows = paginator.keyset_filter(
+            rows, cursor_from.pub_date, cursor_from.pk, newer=False)
+    return rows[:paginator.per_page + 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Печатает EXPLAIN QUERY PLAN для запросов лент и отмечает '
+        'полные просмотры и сортировки во временных B-tree'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Завершиться с ошибкой, если найдены проблемные планы',
+        )
+
+    def sample_queries(self):
+        group = Group.objects.order_by('-posts_count').first()
+        stats = AuthorStats.objects.order_by('-posts_count').first()
+        reader = AuthorStats.objects.order_by('-following_count').first()
+        post = Post.objects.order_by('-comments_count').first()
+        author_id = stats.user_id if stats else None
+        reader_id = reader.user_id if reader else None
+        posts = Post.objects.select_related('author', 'group')
+        return {
+            'index': feed_page(posts.all()),
+            'index (после курсора)': feed_page(
+                posts.all(), cursor_from=post),
+            'group_posts': feed_page(posts.filter(group=group)),
+            'profile': feed_page(posts.filter(author_id=author_id)),
+            'post_detail: комментарии': Comment.objects.filter(
+                post=post).select_related('author'),
+            'follow_index (timeline)': feed_page(
+                Timeline.objects.filter(user_id=reader_id).select_related(
+                    'post__author', 'post__group')),
+            'follow_index (merge)': feed_page(
+                posts.filter(author__following__user_id=reader_id)),
+        }
+
+    def handle(self, *args, **options):
+        problems = 0
+        for name, queryset in self.sample_queries().items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(str(queryset.query))
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f'  {line}')
+                for pattern, message in WARNINGS:
+                    if pattern.search(line):
+                        problems += 1
+                        self.stdout.write(self.style.WARNING(
+                            f'  ^ {message}'))
+            self.stdout.write('')
+        if problems and options['strict']:
+            raise CommandError(f'Проблемных узлов плана: {problems}')
+        self.stdout.write(f'Проблемных узлов плана: {problems}')
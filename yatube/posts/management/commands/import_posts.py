@@ -0,0 +1,201 @@
+import csv
+import json
+import os
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts import bulk
+from posts.models import Group, Post
+
+User = get_user_model()
+
+FORMATS = ('jsonl', 'csv')
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def text_field(row, name):
+    """Значение поля строки; в JSON оно бывает числом, списком и т.п."""
+    value = row.get(name)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise InvalidRow(f'поле {name} - не строка: {value!r}')
+    return value
+
+
+def names(rows, field):
+    """Непустые строковые значения поля; прочее отсеет build."""
+    return {
+        row[field] for row in rows if isinstance(row.get(field), str)
+    } - {''}
+
+
+def read_jsonl(file):
+    # Битая строка не должна обрывать импорт: build её пропустит.
+    for line in file:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def read_csv(file):
+    yield from csv.DictReader(file)
+
+
+class Command(BaseCommand):
+    help = ('Потоково импортирует посты из JSONL или CSV с полями text, '
+            'author, group, pub_date, image; производные данные '
+            'пересобираются один раз в конце')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл или - для stdin')
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='по умолчанию - по расширению файла')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='строк в одной транзакции')
+        parser.add_argument(
+            '--create-authors', action='store_true',
+            help='заводить неизвестных авторов без пароля')
+        parser.add_argument(
+            '--create-groups', action='store_true',
+            help='заводить неизвестные группы по слагу')
+        parser.add_argument(
+            '--skip-thumbnails', action='store_true',
+            help='не нарезать картинки; потом - backfill_thumbnails')
+        parser.add_argument('--workers', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.authors = dict(User.objects.values_list('username', 'pk'))
+        self.groups = dict(Group.objects.values_list('slug', 'pk'))
+        self.author_ids, self.group_ids = set(), set()
+        self.imported = self.skipped = 0
+        started = time.monotonic()
+        with self.open() as file:
+            rows = enumerate(self.reader()(file), start=1)
+            for chunk in bulk.batches(rows, options['batch_size']):
+                self.import_chunk(chunk)
+                rate = self.imported / (time.monotonic() - started) * 60
+                self.stdout.write(
+                    f'Строка {chunk[-1][0]}: импортировано {self.imported}, '
+                    f'пропущено {self.skipped}, {rate:.0f} строк/мин')
+        self.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: импортировано {self.imported}, '
+            f'пропущено {self.skipped}'))
+
+    def open(self):
+        if self.options['path'] == '-':
+            return open(sys.stdin.fileno(), encoding='utf-8', closefd=False)
+        try:
+            return open(self.options['path'], encoding='utf-8', newline='')
+        except OSError as error:
+            raise CommandError(error)
+
+    def reader(self):
+        fmt = self.options['format'] or os.path.splitext(
+            self.options['path'])[1].lstrip('.').lower()
+        if fmt not in FORMATS:
+            raise CommandError('Укажите --format: jsonl или csv')
+        return read_jsonl if fmt == 'jsonl' else read_csv
+
+    def import_chunk(self, chunk):
+        with transaction.atomic():
+            self.create_missing(
+                [row for _, row in chunk if isinstance(row, dict)])
+            posts = []
+            for number, row in chunk:
+                try:
+                    posts.append(self.build(row))
+                except InvalidRow as error:
+                    self.skipped += 1
+                    self.stderr.write(f'Строка {number}: {error}')
+            bulk.create_posts(posts)
+        self.imported += len(posts)
+        self.author_ids.update(post.author_id for post in posts)
+        self.group_ids.update(
+            post.group_id for post in posts if post.group_id)
+
+    def create_missing(self, rows):
+        """Заводит недостающих авторов и группы пачки одним INSERT."""
+        if self.options['create_authors']:
+            password = make_password(None)
+            self.authors.update(self.create(User, [
+                User(username=name, password=password)
+                for name in names(rows, 'author') - self.authors.keys()
+            ], 'username'))
+        if self.options['create_groups']:
+            self.groups.update(self.create(Group, [
+                Group(title=slug, slug=slug, description='')
+                for slug in names(rows, 'group') - self.groups.keys()
+            ], 'slug'))
+
+    @staticmethod
+    def create(model, objects, key):
+        if not objects:
+            return {}
+        model.objects.bulk_create(objects)
+        return model.objects.filter(**{
+            f'{key}__in': [getattr(item, key) for item in objects]
+        }).values_list(key, 'pk')
+
+    def build(self, row):
+        if not isinstance(row, dict):
+            raise InvalidRow('не объект JSON')
+        text = text_field(row, 'text').strip()
+        if not text:
+            raise InvalidRow('пустой текст')
+        author = text_field(row, 'author')
+        author_id = self.authors.get(author)
+        if author_id is None:
+            raise InvalidRow(f'неизвестный автор {author!r}')
+        group_id = None
+        group = text_field(row, 'group')
+        if group:
+            group_id = self.groups.get(group)
+            if group_id is None:
+                raise InvalidRow(f'неизвестная группа {group!r}')
+        return Post(text=text, author_id=author_id, group_id=group_id,
+                    pub_date=self.pub_date(text_field(row, 'pub_date')),
+                    image=text_field(row, 'image'))
+
+    @staticmethod
+    def pub_date(value):
+        if not value:
+            return timezone.now()
+        try:
+            moment = parse_datetime(value)
+        except (TypeError, ValueError):
+            moment = None
+        if moment is None:
+            raise InvalidRow(f'непонятная дата {value!r}')
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    def rebuild(self):
+        self.stdout.write('Пересчитываем счётчики, поиск и ленты…')
+        for label, total in bulk.rebuild_derived(
+                self.options['batch_size']).items():
+            self.stdout.write(f'{label}: {total}')
+        bulk.expire_pages(self.author_ids, self.group_ids)
+        if not self.options['skip_thumbnails']:
+            thumbnails = {'stdout': self.stdout}
+            if self.options['workers']:
+                thumbnails['workers'] = self.options['workers']
+            call_command('backfill_thumbnails', **thumbnails)
@@ -0,0 +1,283 @@
+import logging
+import math
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, as_completed)
+
+import django
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import RequestFactory
+from django.urls import reverse
+
+from posts.models import AuthorStats, Group, Post
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+Step = namedtuple('Step', 'name method path data')
+World = namedtuple('World', 'users posts groups authors')
+Sample = namedtuple('Sample', 'name seconds ok')
+
+
+def browse(world, rng):
+    return [
+        Step('posts:index', 'get', reverse('posts:index'), None),
+        Step('posts:index', 'get', reverse('posts:index'), {'page': 2}),
+        Step('posts:group_posts', 'get', reverse(
+            'posts:group_posts', args=[rng.choice(world.groups)]), None),
+        Step('posts:post_detail', 'get', reverse(
+            'posts:post_detail', args=[rng.choice(world.posts)]), None),
+        Step('posts:profile', 'get', reverse(
+            'posts:profile', args=[rng.choice(world.authors)]), None),
+        Step('posts:follow_index', 'get', reverse('posts:follow_index'), None),
+    ]
+
+
+def follow(world, rng):
+    author = rng.choice(world.authors)
+    return [
+        Step('posts:profile', 'get',
+             reverse('posts:profile', args=[author]), None),
+        Step('posts:profile_follow', 'get',
+             reverse('posts:profile_follow', args=[author]), None),
+        Step('posts:follow_index', 'get', reverse('posts:follow_index'), None),
+    ]
+
+
+def post(world, rng):
+    return [
+        Step('posts:post_create', 'get', reverse('posts:post_create'), None),
+        Step('posts:post_create', 'post', reverse('posts:post_create'),
+             {'text': f'Нагрузочный пост {rng.randrange(10 ** 9)}'}),
+        Step('posts:index', 'get', reverse('posts:index'), None),
+    ]
+
+
+def comment(world, rng):
+    post_id = rng.choice(world.posts)
+    return [
+        Step('posts:post_detail', 'get',
+             reverse('posts:post_detail', args=[post_id]), None),
+        Step('posts:add_comment', 'post',
+             reverse('posts:add_comment', args=[post_id]),
+             {'text': f'Нагрузочный комментарий {rng.randrange(10 ** 9)}'}),
+        Step('posts:post_detail', 'get',
+             reverse('posts:post_detail', args=[post_id]), None),
+    ]
+
+
+SCENARIOS = {
+    'browse': browse,
+    'follow': follow,
+    'post': post,
+    'comment': comment,
+}
+
+
+def scenario_mix(value):
+    """``browse=6,post=1`` -> {'browse': 6.0, 'post': 1.0}."""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise ValueError(f'неизвестный сценарий {name}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(ordered, share):
+    """Перцентиль по ближайшему рангу для отсортированного списка."""
+    return ordered[max(math.ceil(share * len(ordered)) - 1, 0)]
+
+
+class WsgiSession(RequestFactory):
+    """Ходит в yatube.wsgi.application в этом же процессе, как сервер.
+
+    В отличие от тестового клиента, проходит весь стек как есть,
+    с проверкой CSRF.
+    """
+
+    def __init__(self):
+        # С адреса не из INTERNAL_IPS debug toolbar не встраивается в ответ.
+        super().__init__(REMOTE_ADDR='192.0.2.1')
+        from yatube.wsgi import application
+        self.application = application
+
+    def send(self, method, path, data, headers):
+        environ = self._base_environ(**getattr(self, method)(
+            path, data or {}, **headers))
+        status = []
+        response = self.application(
+            environ, lambda line, headers, *args: status.append(
+                (line, headers)))
+        try:
+            for _ in response:
+                pass
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        line, headers = status[0]
+        for name, value in headers:
+            if name.lower() == 'set-cookie':
+                self.cookies.load(value)
+        return int(line.split()[0])
+
+    def request(self, **request):
+        return request
+
+    def cookie(self, name):
+        morsel = self.cookies.get(name)
+        return morsel.value if morsel else ''
+
+
+class HttpSession:
+    """Ходит по HTTP в запущенный сервер."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def send(self, method, path, data, headers):
+        response = self.session.request(
+            method, self.base_url + path,
+            params=data if method == 'get' else None,
+            data=data if method == 'post' else None,
+            headers={name[5:].replace('_', '-'): value
+                     for name, value in headers.items()},
+            allow_redirects=False, timeout=30)
+        return response.status_code
+
+    def cookie(self, name):
+        return self.session.cookies.get(name, '')
+
+
+def csrf_headers(session):
+    # Заголовки в виде META, как их принимает RequestFactory.
+    return {'HTTP_X_CSRFTOKEN': session.cookie('csrftoken')}
+
+
+def log_in(session, username, password):
+    path = reverse('users:login')
+    session.send('get', path, None, {})
+    status = session.send('post', path, {
+        'username': username,
+        'password': password,
+    }, csrf_headers(session))
+    if status != 302:
+        raise RuntimeError(f'не удалось войти как {username}: {status}')
+
+
+def timed(session, step):
+    started = time.perf_counter()
+    try:
+        ok = session.send(
+            step.method, step.path, step.data, csrf_headers(session)) < 400
+    except Exception:
+        logger.debug('Запрос %s упал', step.path, exc_info=True)
+        ok = False
+    return Sample(step.name, time.perf_counter() - started, ok)
+
+
+def run_session(base_url, password, world, mix, seed):
+    """Один пользователь: входит и проходит выбранный по весам сценарий."""
+    rng = random.Random(seed)
+    name = rng.choices(list(mix), weights=list(mix.values()))[0]
+    try:
+        session = HttpSession(base_url) if base_url else WsgiSession()
+        username = rng.choice(world.users)
+        try:
+            log_in(session, username, password)
+        except Exception:
+            logger.debug('Вход упал', exc_info=True)
+            return [Sample('users:login', 0, False)]
+        return [timed(session, step) for step in SCENARIOS[name](world, rng)]
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Гоняет параллельные сессии пользователей по сайту и печатает '
+            'пропускную способность и перцентили времени ответа')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument(
+            '--pool', choices=('thread', 'process'), default='thread')
+        parser.add_argument(
+            '--url',
+            help='адрес запущенного сервера; без него запросы идут '
+                 'в yatube.wsgi.application в этом процессе')
+        parser.add_argument(
+            '--mix', type=scenario_mix,
+            default='browse=6,follow=1,post=1,comment=2',
+            help='веса сценариев: ' + ', '.join(SCENARIOS))
+        parser.add_argument(
+            '--prefix', default='seed',
+            help='сессии входят пользователями с этим префиксом из seed')
+        parser.add_argument('--password', default='seed-password')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        world = self.world(options['prefix'])
+        connections.close_all()
+        if options['pool'] == 'process':
+            pool = ProcessPoolExecutor(
+                max_workers=options['concurrency'], initializer=django.setup)
+        else:
+            pool = ThreadPoolExecutor(max_workers=options['concurrency'])
+        samples = []
+        started = time.perf_counter()
+        with pool:
+            futures = [
+                pool.submit(run_session, options['url'], options['password'],
+                            world, options['mix'], options['seed'] + number)
+                for number in range(options['sessions'])
+            ]
+            for future in as_completed(futures):
+                samples += future.result()
+        self.report(samples, time.perf_counter() - started)
+
+    @staticmethod
+    def world(prefix):
+        users = list(User.objects.filter(
+            username__startswith=f'{prefix}-').order_by('pk').values_list(
+            'username', flat=True)[:1000])
+        world = World(
+            users=users,
+            posts=list(Post.objects.order_by('-pub_date').values_list(
+                'pk', flat=True)[:1000]),
+            groups=list(Group.objects.order_by('-posts_count').values_list(
+                'slug', flat=True)[:100]),
+            authors=list(AuthorStats.objects.order_by(
+                '-followers_count').values_list(
+                'user__username', flat=True)[:100]),
+        )
+        if not all(world):
+            raise CommandError(
+                f'Нет пользователей {prefix}-*, постов или групп; '
+                'сначала запустите seed')
+        return world
+
+    def report(self, samples, elapsed):
+        by_name = {}
+        for sample in samples:
+            by_name.setdefault(sample.name, []).append(sample)
+        self.stdout.write(f'{"URL":<24}{"запросов":>10}{"ошибок":>8}'
+                          f'{"p50":>9}{"p95":>9}{"p99":>9}  мс')
+        for name, group in sorted(by_name.items()):
+            ordered = sorted(sample.seconds * 1000 for sample in group)
+            errors = sum(not sample.ok for sample in group)
+            self.stdout.write(
+                f'{name:<24}{len(group):>10}{errors:>8}'
+                + ''.join(f'{percentile(ordered, share):>9.1f}'
+                          for share in (0.5, 0.95, 0.99)))
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(samples)} запросов за {elapsed:.1f} с, '
+            f'{len(samples) / elapsed:.1f} запросов/с'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики постов, групп и подписок'
+
+    def handle(self, *args, **options):
+        for label, fixed in counters.repair().items():
+            self.stdout.write(f'{label}: исправлено {fixed}')
+        self.stdout.write(self.style.SUCCESS('Счётчики синхронизированы'))
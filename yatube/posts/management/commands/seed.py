@@ -0,0 +1,236 @@
+import random
+from array import array
+from datetime import date, datetime, timedelta
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from faker import Faker
+from PIL import Image, ImageDraw
+
+from posts import bulk, images
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+END = date(2025, 1, 1)
+
+
+def zipf(count, exponent):
+    """Накопленные веса рангов 1..count для random.choices."""
+    return list(accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, группами, '
+            'постами, комментариями и подписками для замеров')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='сколько в среднем подписок у пользователя')
+        parser.add_argument(
+            '--exponent', type=float, default=1.1,
+            help='показатель степенного закона популярности авторов')
+        parser.add_argument(
+            '--images', type=int, default=0,
+            help='сколько разных картинок раздать постам')
+        parser.add_argument('--image-ratio', type=float, default=0.3)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument(
+            '--end', type=date.fromisoformat, default=END,
+            help='последний день окна дат, ГГГГ-ММ-ДД; от него '
+                 'отсчитывается --days, поэтому от дня запуска данные '
+                 'не зависят')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--prefix', default='seed',
+            help='префикс имён пользователей и слагов групп')
+        parser.add_argument('--password', default='seed-password')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('Нужно хотя бы два пользователя')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(
+                f'Пользователи {prefix}-* уже есть, укажите другой --prefix')
+        self.options = options
+        self.random = random.Random(options['seed'])
+        self.fake = Faker('ru_RU')
+        self.fake.seed_instance(options['seed'])
+        end = options['end']
+        self.end = datetime(end.year, end.month, end.day, tzinfo=timezone.utc)
+        self.start = self.end - timedelta(days=options['days'])
+
+        users = self.create_users()
+        groups = self.create_groups()
+        pictures = self.create_images()
+        posts, dates = self.create_posts(users, groups, pictures)
+        self.create_comments(users, posts, dates)
+        self.create_follows(users)
+        self.stdout.write('Пересчитываем счётчики, поиск и ленты…')
+        for label, total in bulk.rebuild_derived(
+                options['batch_size']).items():
+            self.stdout.write(f'{label}: {total}')
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    def progress(self, label, done, total=None):
+        self.stdout.write(f'{label}: {done}/{total}' if total else
+                          f'{label}: {done}')
+
+    def insert(self, label, model, objects, total, dates=()):
+        """bulk_create пачками с отчётом; возвращает новые строки.
+
+        На SQLite bulk_create не отдаёт pk, поэтому новые строки находим
+        по pk больше последнего до вставки.
+        """
+        last = model.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+        done = 0
+        for batch in bulk.batches(objects, self.options['batch_size']):
+            if model is Post:
+                bulk.create_posts(batch)
+            else:
+                with bulk.explicit_dates(model, *dates), transaction.atomic():
+                    model.objects.bulk_create(batch)
+            done += len(batch)
+            self.progress(label, done, total)
+        return model.objects.filter(pk__gt=last).order_by('pk')
+
+    def create_users(self):
+        total = self.options['users']
+        password = make_password(self.options['password'])
+        prefix = self.options['prefix']
+        return self.pks(self.insert('Пользователи', User, (
+            User(username=f'{prefix}-{number}', password=password,
+                 first_name=self.fake.first_name(),
+                 last_name=self.fake.last_name())
+            for number in range(total)
+        ), total))
+
+    def create_groups(self):
+        total = self.options['groups']
+        prefix = self.options['prefix']
+        return self.pks(self.insert('Группы', Group, (
+            Group(title=f'{self.fake.word().capitalize()} {number}',
+                  slug=f'{prefix}-{number}',
+                  description=self.fake.sentence())
+            for number in range(total)
+        ), total))
+
+    @staticmethod
+    def pks(rows):
+        return array('q', rows.values_list('pk', flat=True).iterator())
+
+    def create_images(self):
+        """Сохраняет картинки и их нарезки; [(имя, заглушка)]."""
+        storage = images.source_storage()
+        pictures = []
+        for number in range(self.options['images']):
+            image = Image.new('RGB', (1280, 720), self.color())
+            draw = ImageDraw.Draw(image)
+            for _ in range(8):
+                x, y = self.random.randrange(1280), self.random.randrange(720)
+                size = self.random.randrange(40, 400)
+                draw.ellipse((x, y, x + size, y + size), fill=self.color())
+            buffer = BytesIO()
+            image.save(buffer, 'JPEG', quality=85)
+            name = storage.save(
+                f'posts/seed-{number}.jpg', ContentFile(buffer.getvalue()))
+            images.build(name)
+            pictures.append((name, images.stored_placeholder(name)))
+            self.progress('Картинки', number + 1, self.options['images'])
+        return pictures
+
+    def color(self):
+        return tuple(self.random.randrange(256) for _ in range(3))
+
+    def moment(self):
+        return self.start + (self.end - self.start) * self.random.random()
+
+    def popular(self, pks):
+        """pk в случайном порядке популярности и веса к ним."""
+        ranked = self.random.sample(list(pks), len(pks))
+        return ranked, zipf(len(ranked), self.options['exponent'])
+
+    def create_posts(self, users, groups, pictures):
+        total = self.options['posts']
+        authors, author_weights = self.popular(users)
+        ranked_groups, group_weights = self.popular(groups)
+
+        def posts():
+            for _ in range(total):
+                post = Post(
+                    author_id=self.random.choices(
+                        authors, cum_weights=author_weights)[0],
+                    text='\n\n'.join(self.fake.paragraphs(
+                        nb=self.random.randint(1, 4))),
+                    pub_date=self.moment(),
+                )
+                if ranked_groups and self.random.random() < 0.7:
+                    post.group_id = self.random.choices(
+                        ranked_groups, cum_weights=group_weights)[0]
+                if (pictures and self.random.random()
+                        < self.options['image_ratio']):
+                    post.image, post.image_placeholder = self.random.choice(
+                        pictures)
+                yield post
+
+        pks, dates = array('q'), array('d')
+        for pk, pub_date in self.insert(
+                'Посты', Post, posts(), total
+        ).values_list('pk', 'pub_date').iterator():
+            pks.append(pk)
+            dates.append(pub_date.timestamp())
+        return pks, dates
+
+    def create_comments(self, users, posts, dates):
+        total = self.options['comments'] if posts else 0
+        ranked, weights = self.popular(range(len(posts)))
+
+        def comments():
+            for _ in range(total):
+                position = self.random.choices(ranked, cum_weights=weights)[0]
+                posted = dates[position] + self.random.expovariate(1 / 3600)
+                yield Comment(
+                    post_id=posts[position],
+                    author_id=self.random.choice(users),
+                    text=self.fake.sentence(),
+                    created=min(
+                        datetime.fromtimestamp(posted, timezone.utc),
+                        self.end),
+                )
+
+        self.insert('Комментарии', Comment, comments(), total, ('created',))
+
+    def create_follows(self, users):
+        """Подписки со степенным распределением числа подписчиков."""
+        authors, weights = self.popular(users)
+        # Среднее у Парето с показателем 1.5 равно трём.
+        scale = self.options['follows'] / 3
+
+        def follows():
+            for user in users:
+                count = min(int(self.random.paretovariate(1.5) * scale),
+                            len(users) - 1)
+                chosen = set(self.random.choices(
+                    authors, cum_weights=weights, k=count))
+                chosen.discard(user)
+                for author in sorted(chosen):
+                    yield Follow(user_id=user, author_id=author)
+
+        self.insert('Подписки', Follow, follows(), None)
@@ -0,0 +1,51 @@
+# Generated by Django 2.2.16 on 2026-10-18 03:33
+
+from django.db import migrations, models
+from django.utils.html import escape, linebreaks
+from django.utils.text import Truncator, normalize_newlines
+
+
+# Копии posts.text на момент миграции: модуль может измениться, а
+# миграция должна заполнять поля так же, как при её написании.
+def to_html(text):
+    return linebreaks(text, autoescape=True)
+
+
+def to_excerpt(text):
+    short = Truncator(text).words(30)
+    return escape(normalize_newlines(short)).replace('\n', '<br>')
+
+
+def render_texts(apps, schema_editor):
+    # Пишем в ту же таблицу, что читаем, поэтому режем по списку id,
+    # а не по открытому курсору.
+    Post = apps.get_model('posts', 'Post')
+    pks = list(Post.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(pks), 500):
+        posts = list(Post.objects.filter(
+            pk__in=pks[start:start + 500]).only('text'))
+        for post in posts:
+            post.text_html = to_html(post.text)
+            post.excerpt = to_excerpt(post.text)
+        Post.objects.bulk_update(posts, ('text_html', 'excerpt'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Начало текста в HTML'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='text_html',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Текст в HTML'),
+        ),
+        migrations.RunPython(render_texts, migrations.RunPython.noop),
+    ]
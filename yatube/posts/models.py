@@ -1,6 +1,10 @@
 from django.contrib.auth import get_user_model
-
+from django.core.files.storage import default_storage
 from django.db import models
+from django.utils.functional import cached_property
+
+from . import text as rendering
+from .storage import ContentAddressedStorage
 
 User = get_user_model()
 
@@ -9,6 +13,7 @@ class Group(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
 
     def __str__(self):
         return self.title
@@ -17,6 +22,10 @@ class Group(models.Model):
 class Post(models.Model):
     text = models.TextField(verbose_name='Текст поста',
                             help_text='Введите текст поста',)
+    text_html = models.TextField(
+        'Текст в HTML', blank=True, default='', editable=False)
+    excerpt = models.TextField(
+        'Начало текста в HTML', blank=True, default='', editable=False)
     pub_date = models.DateTimeField(verbose_name='Дата публикации',
                                     auto_now_add=True,)
     author = models.ForeignKey(
@@ -24,6 +33,7 @@ class Post(models.Model):
         on_delete=models.CASCADE,
         related_name='posts',
         verbose_name='Автор',
+        db_index=False,
     )
 
     def __str__(self):
@@ -37,15 +47,63 @@ class Post(models.Model):
         related_name='posts',
         verbose_name='Группа',
         help_text='Выберите группу',
+        db_index=False,
     )
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    image_placeholder = models.TextField(
+        'Заглушка картинки',
+        blank=True,
+        default='',
+        editable=False,
+        help_text='Крошечное превью картинки в виде data URI',
+    )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев',
+        default=0,
+    )
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-pk')
+        # Индексы повторяют порядок ленты, поэтому страницы index,
+        # group_posts и profile читаются без сортировки; отдельные
+        # индексы внешних ключей покрыты префиксами.
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'), name='post_pub_date_idx'),
+            models.Index(
+                fields=('group', '-pub_date', '-id'),
+                name='post_group_date_idx'),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='post_author_date_idx'),
+        )
+
+    @cached_property
+    def image_variants(self):
+        """Готовые нарезки картинки по алиасу из POST_IMAGE_VARIANTS."""
+        if not self.image:
+            return {}
+        return {variant.alias: variant for variant in
+                ImageVariant.objects.filter(source=self.image.name)}
+
+    def fill_rendered_text(self):
+        """Считает text_html и excerpt; bulk_create сам его не вызывает."""
+        self.text_html = rendering.to_html(self.text)
+        self.excerpt = rendering.to_excerpt(self.text)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'text' in update_fields:
+            self.fill_rendered_text()
+            if update_fields is not None:
+                kwargs['update_fields'] = {
+                    *update_fields, 'text_html', 'excerpt'}
+        super().save(*args, **kwargs)
 
 
 class Comment(models.Model):
@@ -54,7 +112,8 @@ class Comment(models.Model):
         on_delete=models.CASCADE,
         related_name='comments',
         verbose_name='Пост, к которому крепится комментарий',
-        help_text='Укажите пост'
+        help_text='Укажите пост',
+        db_index=False,
     )
     author = models.ForeignKey(
         User,
@@ -73,6 +132,10 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created']
+        indexes = (
+            models.Index(
+                fields=('post', '-created'), name='comment_post_created_idx'),
+        )
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
 
@@ -93,7 +156,8 @@ class Follow(models.Model):
         on_delete=models.CASCADE,
         related_name='following',
         verbose_name='Автор',
-        help_text='Укажите автора'
+        help_text='Укажите автора',
+        db_index=False,
     )
 
     class Meta:
@@ -101,8 +165,120 @@ class Follow(models.Model):
             models.UniqueConstraint(
                 fields=('user', 'author'), name='follow_unique'),
         )
+        indexes = (
+            models.Index(
+                fields=('author', 'user'), name='follow_author_user_idx'),
+        )
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
 
     def __str__(self):
         return self.user.username, self.author.username
+
+
+class AuthorStats(models.Model):
+    """Денормализованные счётчики пользователя.
+
+    Поддерживаются сигналами posts.signals, расхождения чинит
+    команда repair_counters.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь',
+    )
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0)
+    following_count = models.PositiveIntegerField(
+        'Число подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Счётчики автора'
+        verbose_name_plural = 'Счётчики авторов'
+
+    def __str__(self):
+        return str(self.user)
+
+
+class Timeline(models.Model):
+    """Материализованная лента подписок: одна строка на пост у подписчика.
+
+    Дата публикации продублирована из поста, чтобы страница ленты
+    читалась по индексу (user, pub_date) без JOIN через Follow.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик',
+        db_index=False,
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост',
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        ordering = ('-pub_date', '-pk')
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'post'), name='timeline_unique'),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-id'),
+                name='timeline_user_date_idx'),
+        )
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+
+
+class StoredImage(models.Model):
+    """Файл картинки и число постов, которые на него ссылаются.
+
+    Поддерживается сигналами posts.signals; файл и его нарезки
+    удаляются, только когда ссылок не осталось.
+    """
+    name = models.CharField('Файл', max_length=100, unique=True)
+    refs = models.PositiveIntegerField('Число постов', default=0)
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
+
+    def __str__(self):
+        return self.name
+
+
+class ImageVariant(models.Model):
+    """Нарезка картинки поста, сделанная фоновым пулом posts.images.
+
+    Привязана к имени исходного файла, а не к посту, поэтому одна
+    нарезка обслуживает все посты с этим файлом.
+    """
+    source = models.CharField('Исходный файл', max_length=255)
+    alias = models.CharField('Вариант', max_length=32)
+    name = models.CharField('Файл нарезки', max_length=255)
+    width = models.PositiveIntegerField('Ширина')
+    height = models.PositiveIntegerField('Высота')
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('source', 'alias'), name='image_variant_unique'),
+        )
+        verbose_name = 'Нарезка картинки'
+        verbose_name_plural = 'Нарезки картинок'
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def url(self):
+        return default_storage.url(self.name)
@@ -0,0 +1,100 @@
+"""Бюджет запросов к базе на один запрос к сайту.
+
+QueryRecorder подключается через connection.execute_wrapper и для каждого
+запроса запоминает SQL без параметров и строку шаблона, откуда он пришёл.
+Одинаковый SQL, выполненный N_PLUS_ONE_THRESHOLD раз и больше, почти
+всегда значит N+1: связь читается в цикле по одному объекту.
+QueryBudgetMiddleware пишет такие места в лог и сверяет число запросов
+с QUERY_BUDGETS по имени URL.
+"""
+import logging
+import sys
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template.base import Node
+
+logger = logging.getLogger(__name__)
+
+Query = namedtuple('Query', 'sql source')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def template_line():
+    """``шаблон:строка`` узла, который сейчас рендерится, или None."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        if (frame.f_code.co_name == 'render_annotated'
+                and isinstance(node, Node) and node.token is not None):
+            return f'{node.origin.template_name}:{node.token.lineno}'
+        frame = frame.f_back
+    return None
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(Query(sql, template_line()))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold=None):
+        """[(sql, сколько раз, откуда первый раз)] для повторов SQL."""
+        threshold = threshold or settings.N_PLUS_ONE_THRESHOLD
+        counts = Counter(query.sql for query in self.queries)
+        sources = {}
+        for query in self.queries:
+            sources.setdefault(query.sql, query.source)
+        return [(sql, count, sources[sql])
+                for sql, count in counts.items() if count >= threshold]
+
+
+@contextmanager
+def recording():
+    """Пишет запросы внутри блока в QueryRecorder; для тестов и команд."""
+    recorder = QueryRecorder()
+    with connection.execute_wrapper(recorder):
+        yield recorder
+
+
+def budget(view_name):
+    return settings.QUERY_BUDGETS.get(view_name, settings.QUERY_BUDGET_DEFAULT)
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        if not settings.QUERY_BUDGET_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with recording() as recorder:
+            response = self.get_response(request)
+        match = request.resolver_match
+        self.check(request.path, match and match.view_name, recorder)
+        return response
+
+    @staticmethod
+    def check(path, view_name, recorder):
+        for sql, count, source in recorder.repeated():
+            logger.warning('N+1 на %s: %d раз из %s: %s',
+                           path, count, source or 'кода', sql)
+        limit = budget(view_name)
+        if limit is None or len(recorder) <= limit:
+            return
+        message = (f'{path} ({view_name}): {len(recorder)} запросов '
+                   f'при бюджете {limit}')
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.error(message)
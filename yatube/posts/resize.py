@@ -0,0 +1,156 @@
+"""Ресайз картинок постов по подписанным ссылкам.
+
+Ссылку строит тег ``{% resized_url %}``, так что шаблон ничего не рендерит.
+Картинка нарезается при первом запросе и кладётся в дисковый кэш
+RESIZE_CACHE_ROOT. Его размер ограничен RESIZE_CACHE_MAX_BYTES: лишнее
+вытесняется, начиная с давно не читанных файлов. Одновременные запросы
+одного размера ждут единственную нарезку.
+
+Размер кэша процесс считает сам: обходит каталог один раз при первой
+нарезке и потом только при вытеснении, которое заодно сверяет счётчик
+с диском. Записи других процессов попадут в счёт при этом обходе.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+
+from django.conf import settings
+from django.core.signing import Signer
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+
+from . import images
+
+signer = Signer(salt='posts.resize')
+
+_locks = weakref.WeakValueDictionary()
+_locks_guard = threading.Lock()
+
+# Вытесняем с запасом, чтобы следующий обход каталога был нескоро.
+EVICT_TO = 0.9
+_usage = None
+_usage_guard = threading.Lock()
+
+
+def _value(width, height, path):
+    return f'{width}x{height}/{path}'
+
+
+def signature(width, height, path):
+    return signer.signature(_value(width, height, path))
+
+
+def is_valid(token, width, height, path):
+    return constant_time_compare(token, signature(width, height, path))
+
+
+def resized_url(path, width, height):
+    return reverse('posts:resize_image', kwargs={
+        'signature': signature(width, height, path),
+        'width': width,
+        'height': height,
+        'path': path,
+    })
+
+
+def cache_path(width, height, path):
+    digest = hashlib.sha1(_value(width, height, path).encode()).hexdigest()
+    return os.path.join(
+        settings.RESIZE_CACHE_ROOT, digest[:2], f'{digest}.jpg')
+
+
+def _lock(key):
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = threading.Lock()
+        return lock
+
+
+def _write(target, data):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Блокировка ключа общая только внутри процесса, поэтому временный
+    # файл у каждой записи свой: другой процесс может резать то же самое.
+    descriptor, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(target), suffix='.tmp')
+    with os.fdopen(descriptor, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, target)
+    return len(data)
+
+
+def _entries():
+    for directory, _, names in os.walk(settings.RESIZE_CACHE_ROOT):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith('.jpg'):
+                yield stat.st_mtime, stat.st_size, path
+
+
+def evict(keep=None):
+    """Удаляет давно не читанные файлы, пока кэш не влезет в лимит.
+
+    Файл ``keep`` не трогаем: его сейчас отдают. Возвращает размер
+    оставшегося кэша.
+    """
+    entries = sorted(_entries())
+    total = sum(size for _, size, _ in entries)
+    limit = settings.RESIZE_CACHE_MAX_BYTES
+    if total <= limit:
+        return total
+    for _, size, path in entries:
+        if total <= limit * EVICT_TO:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+
+def _account(written, keep):
+    global _usage
+    with _usage_guard:
+        if _usage is None:
+            _usage = sum(size for _, size, _ in _entries())
+        else:
+            _usage += written
+        if _usage > settings.RESIZE_CACHE_MAX_BYTES:
+            _usage = evict(keep=keep)
+
+
+def get(width, height, path):
+    """Путь к нарезке в кэше; нарезает её, если нужно, ровно один раз."""
+    target = cache_path(width, height, path)
+    try:
+        # Время изменения служит отметкой последнего чтения для LRU.
+        os.utime(target)
+        return target
+    except FileNotFoundError:
+        pass
+    with _lock(target):
+        if not os.path.exists(target):
+            _account(_write(target, images.fit(path, (width, height))),
+                     keep=target)
+    return target
+
+
+def open_resized(width, height, path):
+    """Открытый файл нарезки.
+
+    Между get и open файл могут вытеснить соседние запросы; тогда
+    нарезаем его заново. Открытый файл удаление уже не затронет.
+    """
+    try:
+        return open(get(width, height, path), 'rb')
+    except FileNotFoundError:
+        return open(get(width, height, path), 'rb')
@@ -0,0 +1,153 @@
+"""Полнотекстовый поиск по постам на SQLite FTS5.
+
+Индекс ``posts_post_fts`` хранит текст поста под rowid, равным id поста.
+Он обновляется сигналами при сохранении и удалении постов, а целиком
+пересобирается командой ``rebuild_search_index``. На других СУБД поиск
+откатывается к ``icontains``.
+"""
+import base64
+import binascii
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Post
+
+TABLE = 'posts_post_fts'
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def create_index(cursor):
+    cursor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5('
+        "text, tokenize='unicode61 remove_diacritics 2')"
+    )
+
+
+def to_match(query):
+    """Превращает ввод пользователя в безопасный запрос FTS5.
+
+    Каждое слово берётся в кавычки, поэтому операторы FTS5 в запросе
+    не срабатывают; слова объединяются через неявное AND.
+    """
+    words = query.split()
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def index_post(post):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, post.text],
+        )
+
+
+def remove_post(post_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [post_id])
+
+
+def rebuild(batch_size=1000):
+    """Пересобирает индекс пачками; возвращает число проиндексированных."""
+    if not is_available():
+        return 0
+    rows = Post.objects.order_by('pk').values_list('pk', 'text').iterator(
+        chunk_size=batch_size)
+    total = 0
+    # Без транзакции SQLite фиксирует каждую вставленную строку отдельно.
+    with transaction.atomic(), connection.cursor() as cursor:
+        create_index(cursor)
+        cursor.execute(f'DELETE FROM {TABLE}')
+        batch = list(islice(rows, batch_size))
+        while batch:
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (rowid, text) VALUES (%s, %s)', batch)
+            total += len(batch)
+            batch = list(islice(rows, batch_size))
+    return total
+
+
+def filter_posts(queryset, query):
+    """Ограничивает queryset постами, подходящими под запрос."""
+    if not is_available():
+        return queryset.filter(text__icontains=query)
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s',
+        [to_match(query)],
+    ))
+
+
+def encode_cursor(rank, pk):
+    raw = f'{rank!r}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        rank, pk = base64.urlsafe_b64decode(
+            padded.encode()).decode().split('|')
+        return float(rank), int(pk)
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+
+
+def _highlight(snippet):
+    return mark_safe(escape(snippet).replace(
+        MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def search(query, after=None, limit=10):
+    """Страница результатов по релевантности (bm25) с keyset-курсором.
+
+    Возвращает посты с атрибутами ``search_rank`` и ``search_snippet``
+    и курсор следующей страницы (или None).
+    """
+    match = to_match(query)
+    if not match:
+        return [], None
+    if not is_available():
+        posts = Post.objects.select_related('author', 'group').defer('text')
+        return list(filter_posts(posts, query)[:limit]), None
+    cursor_filter, params = '', [match]
+    after = decode_cursor(after) if after else None
+    if after is not None:
+        cursor_filter = 'WHERE (score, rowid) > (%s, %s)'
+        params.extend(after)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT rowid, score, snippet FROM ('
+            f' SELECT rowid, bm25({TABLE}) AS score,'
+            f" snippet({TABLE}, 0, %s, %s, '…', 24) AS snippet"
+            f' FROM {TABLE} WHERE {TABLE} MATCH %s'
+            f') {cursor_filter} ORDER BY score, rowid LIMIT %s',
+            [MARK_START, MARK_END, *params, limit + 1],
+        )
+        rows = cursor.fetchall()
+    posts = Post.objects.select_related('author', 'group').defer(
+        'text').in_bulk(
+        [pk for pk, _, _ in rows[:limit]])
+    results = []
+    for pk, rank, snippet in rows[:limit]:
+        if pk in posts:
+            post = posts[pk]
+            post.search_rank = rank
+            post.search_snippet = _highlight(snippet)
+            results.append(post)
+    next_cursor = None
+    if len(rows) > limit:
+        pk, rank, _ = rows[limit - 1]
+        next_cursor = encode_cursor(rank, pk)
+    return results, next_cursor
@@ -0,0 +1,267 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import caching, counters, feeds, images, search, surrogate
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+def uses_timelines():
+    return settings.FOLLOW_FEED == 'timeline'
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feeds.remember_post(instance)
+        if uses_timelines():
+            feeds.push_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def drop_recent_posts(sender, instance, **kwargs):
+    feeds.forget_authors(instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and uses_timelines():
+        feeds.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    if uses_timelines():
+        feeds.prune(instance.user_id, instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def remember_stored_state(sender, instance, raw=False, **kwargs):
+    instance._stored_group_id = instance._stored_image = None
+    # Ссылку на новую загрузку возьмёт хранилище при сохранении файла.
+    instance._uploading_image = bool(
+        instance.image) and not instance.image._committed
+    if instance.pk and not raw:
+        stored = Post.objects.filter(
+            pk=instance.pk).values_list('group_id', 'image').first()
+        if stored is not None:
+            instance._stored_group_id, instance._stored_image = stored
+
+
+@receiver(pre_save, sender=Post)
+def fill_image_placeholder(sender, instance, raw=False, **kwargs):
+    if raw or instance.image.name == instance._stored_image:
+        return
+    instance.image_placeholder = (
+        images.placeholder_for(instance.image) if instance.image else '')
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    with transaction.atomic():
+        if created:
+            counters.shift_author(instance.author_id, posts_count=1)
+            counters.shift_group(instance.group_id, 1)
+        elif instance._stored_group_id != instance.group_id:
+            counters.shift_group(instance._stored_group_id, -1)
+            counters.shift_group(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    with transaction.atomic():
+        counters.shift_author(instance.author_id, posts_count=-1)
+        counters.shift_group(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.shift_comments(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.shift_comments(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_saved_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        with transaction.atomic():
+            counters.shift_author(instance.author_id, followers_count=1)
+            counters.shift_author(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    with transaction.atomic():
+        counters.shift_author(instance.author_id, followers_count=-1)
+        counters.shift_author(instance.user_id, following_count=-1)
+
+
+def author_scopes(*user_ids):
+    # Пользователь может быть уже удалён каскадом, поэтому не ходим
+    # по связям экземпляра, а спрашиваем имена одним запросом.
+    return [f'author:{username}' for username in User.objects.filter(
+        pk__in=user_ids).values_list('username', flat=True)]
+
+
+def expire_post(post, *group_ids):
+    """Сбрасывает страницы поста: версии кэша и ключи прокси."""
+    slugs = Group.objects.filter(
+        pk__in={post.group_id, *group_ids} - {None}
+    ).values_list('slug', flat=True)
+    caching.bump('feed', f'post:{post.pk}', *author_scopes(post.author_id),
+                 *(f'group:{slug}' for slug in slugs))
+    surrogate.purge('feed', f'post-{post.pk}', f'author-{post.author_id}',
+                    *(f'group-{slug}' for slug in slugs))
+
+
+@receiver(post_save, sender=Post)
+def expire_saved_post_pages(sender, instance, raw=False, **kwargs):
+    if not raw:
+        expire_post(instance, getattr(instance, '_stored_group_id', None))
+
+
+@receiver(post_delete, sender=Post)
+def expire_deleted_post_pages(sender, instance, **kwargs):
+    expire_post(instance)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def expire_comment_pages(sender, instance, raw=False, **kwargs):
+    post = Post.objects.filter(pk=instance.post_id).first()
+    if post is not None and not raw:
+        expire_post(post)
+
+
+def group_author_ids(group):
+    return list(User.objects.filter(posts__group=group).values_list(
+        'pk', flat=True).distinct())
+
+
+def stored_value(instance, field):
+    """Значение поля в базе до сохранения; None у новых объектов."""
+    if not instance.pk:
+        return None
+    return type(instance).objects.filter(pk=instance.pk).values_list(
+        field, flat=True).first()
+
+
+@receiver(pre_save, sender=Group)
+def remember_stored_slug(sender, instance, raw=False, **kwargs):
+    # После смены слага старый адрес должен перестать отдаваться из кэша.
+    instance._stored_slug = None if raw else stored_value(instance, 'slug')
+
+
+@receiver(pre_delete, sender=Group)
+def remember_group_authors(sender, instance, **kwargs):
+    # После удаления у постов уже не будет группы, по которой их искать.
+    instance._author_ids = group_author_ids(instance)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def expire_group_pages(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+    # Ссылки на группу есть в карточках профилей её авторов.
+    author_ids = [] if created else getattr(
+        instance, '_author_ids', None) or group_author_ids(instance)
+    slugs = {instance.slug, getattr(instance, '_stored_slug', None)} - {None}
+    caching.bump('feed', f'group-id:{instance.pk}',
+                 *(f'group:{slug}' for slug in slugs),
+                 *author_scopes(*author_ids))
+    surrogate.purge('feed', *(f'group-{slug}' for slug in slugs),
+                    *(f'author-{pk}' for pk in author_ids))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def expire_follow_pages(sender, instance, raw=False, **kwargs):
+    if not raw:
+        caching.bump(*author_scopes(instance.author_id, instance.user_id))
+        surrogate.purge(f'author-{instance.author_id}',
+                        f'author-{instance.user_id}')
+
+
+def is_login(update_fields):
+    # Вход пользователя пишет только last_login.
+    return set(update_fields or ()) == {'last_login'}
+
+
+@receiver(pre_save, sender=User)
+def remember_stored_username(sender, instance, raw=False,
+                             update_fields=None, **kwargs):
+    instance._stored_username = None
+    if not raw and not is_login(update_fields):
+        instance._stored_username = stored_value(instance, 'username')
+
+
+@receiver(post_save, sender=User)
+def expire_author_cards(sender, instance, created=False, raw=False,
+                        update_fields=None, **kwargs):
+    # От входа карточки не меняются. У нового пользователя
+    # закэшированных страниц нет.
+    if raw or created or is_login(update_fields):
+        return
+    # Карточки лежат внутри закэшированных страниц лент, профиля
+    # и групп автора, поэтому сбрасываем и их. Профиль - и под старым
+    # именем, если его сменили: ключ прокси у него по id.
+    slugs = Group.objects.filter(posts__author=instance).values_list(
+        'slug', flat=True).distinct()
+    usernames = {instance.username,
+                 getattr(instance, '_stored_username', None)} - {None}
+    caching.bump('feed', f'user:{instance.pk}',
+                 *(f'author:{username}' for username in usernames),
+                 *(f'group:{slug}' for slug in slugs))
+    surrogate.purge('feed', f'author-{instance.pk}',
+                    *(f'group-{slug}' for slug in slugs))
+
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def render_image_variants(sender, instance, created, raw=False, **kwargs):
+    if raw or not instance.image:
+        return
+    if created or instance._stored_image != instance.image.name:
+        images.schedule(instance.image.name)
+
+
+@receiver(post_save, sender=Post)
+def count_image_refs(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    image, stored = instance.image.name or '', instance._stored_image or ''
+    uploaded = instance._uploading_image
+    if image != stored or uploaded:
+        with transaction.atomic():
+            if image and not uploaded:
+                images.acquire(image)
+            if stored:
+                images.release(stored)
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    if instance.image:
+        images.release(instance.image.name)
@@ -0,0 +1,37 @@
+import hashlib
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранит файлы под sha256 их содержимого.
+
+    Имя считается по чанкам, без чтения файла в память целиком.
+    Одинаковые загрузки получают одно имя и один файл на диске;
+    когда файл можно удалять, решает счётчик ссылок StoredImage.
+    Ссылку на сохранённый файл берёт само хранилище, а сигнал поста
+    для загрузок её уже не добавляет.
+    """
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        name = posixpath.join(directory, digest.hexdigest() + extension)
+        # Ссылку берём до проверки: иначе images.collect успеет удалить
+        # файл между exists и сохранением поста. Модели импортируют
+        # хранилище, поэтому счётчики - только здесь.
+        from .counters import shift_image
+        shift_image(name, 1)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
@@ -0,0 +1,69 @@
+"""Surrogate-ключи для HTTP-кэша перед сайтом.
+
+Ответы представлений posts помечаются ключами ``feed``, ``post-<id>``,
+``author-<id>`` и ``group-<slug>``. Сигналы моделей после коммита
+отправляют purge этих ключей в бэкенд из PURGE_BACKEND, поэтому прокси
+может держать страницы часами и не отдавать устаревшее. Личная лента
+подписок не помечается и уходит с Cache-Control: private.
+"""
+import logging
+from collections import deque
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def post_keys(posts):
+    """Ключи постов страницы; только по id, без обращений к связям."""
+    keys = []
+    for post in posts:
+        keys += [f'post-{post.pk}', f'author-{post.author_id}']
+    return keys
+
+
+def tag(response, *keys):
+    """Добавляет ключи к ответу и разрешает прокси хранить его."""
+    header = settings.SURROGATE_KEY_HEADER
+    current = response.get(header, '').split()
+    response[header] = ' '.join(dict.fromkeys([*current, *keys]))
+    response['Surrogate-Control'] = f'max-age={settings.EDGE_CACHE_TIMEOUT}'
+    return response
+
+
+class LocalPurgeBackend:
+    """Запоминает последние сброшенные ключи; для разработки и тестов."""
+    purged = deque(maxlen=1000)
+
+    def purge(self, keys):
+        self.purged.extend(keys)
+
+
+class HttpPurgeBackend:
+    """Шлёт ключи на PURGE_URL заголовком SURROGATE_KEY_HEADER."""
+
+    def purge(self, keys):
+        try:
+            response = requests.request(
+                settings.PURGE_METHOD,
+                settings.PURGE_URL,
+                headers={settings.SURROGATE_KEY_HEADER: ' '.join(keys)},
+                timeout=settings.PURGE_TIMEOUT,
+            )
+            response.raise_for_status()
+        except requests.RequestException:
+            logger.exception('Не удалось сбросить ключи %s', keys)
+
+
+def backend():
+    return import_string(settings.PURGE_BACKEND)()
+
+
+def purge(*keys):
+    """Сбрасывает ключи в прокси после фиксации транзакции."""
+    keys = list(dict.fromkeys(keys))
+    if keys:
+        transaction.on_commit(lambda: backend().purge(keys))
@@ -0,0 +1,57 @@
+from django import template
+
+from posts import caching, resize
+
+register = template.Library()
+
+
+@register.simple_tag
+def page_window(page_obj, on_each_side=2, on_ends=1):
+    """Ограниченный список номеров страниц вокруг текущей."""
+    return list(page_obj.paginator.get_elided_page_range(
+        page_obj.number, on_each_side=on_each_side, on_ends=on_ends))
+
+
+@register.simple_tag
+def resized_url(image, width, height):
+    """Подписанная ссылка на картинку нужного размера; сам тег не ресайзит."""
+    return resize.resized_url(image.name, width, height) if image else ''
+
+
+@register.simple_tag
+def prefetch_cards(posts, fragment):
+    """Достаёт из кэша карточки всех постов страницы одним get_many."""
+    return caching.CardBatch(posts, fragment)
+
+
+class CardNode(template.Node):
+    def __init__(self, nodelist, post, cards):
+        self.nodelist = nodelist
+        self.post = post
+        self.cards = cards
+
+    def render(self, context):
+        post = self.post.resolve(context)
+        cards = self.cards.resolve(context)
+        html = cards.get(post)
+        if html is None:
+            html = self.nodelist.render(context)
+            cards.set(post, html)
+        return html
+
+
+@register.tag
+def card(parser, token):
+    """Кэшируемая карточка поста: {% card post cards %}...{% endcard %}.
+
+    Тело не должно зависеть от пользователя: карточка общая для всех.
+    """
+    try:
+        _, post, cards = token.split_contents()
+    except ValueError:
+        raise template.TemplateSyntaxError(
+            'Использование: {% card post cards %}')
+    nodelist = parser.parse(('endcard',))
+    parser.delete_first_token()
+    return CardNode(
+        nodelist, parser.compile_filter(post), parser.compile_filter(cards))
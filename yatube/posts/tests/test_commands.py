@@ -0,0 +1,233 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from .. import counters, feeds, search
+from ..management.commands import loadtest
+from ..management.commands.seed import END as SEED_END
+from ..models import AuthorStats, Comment, Follow, Group, Post, Timeline
+
+User = get_user_model()
+
+
+class SeedCommandTest(TestCase):
+    def seed(self, prefix):
+        call_command('seed', prefix=prefix, seed=3, users=12, groups=3,
+                     posts=60, comments=40, follows=4, batch_size=25,
+                     stdout=StringIO())
+        users = User.objects.filter(username__startswith=f'{prefix}-')
+        posts = Post.objects.filter(author__in=users).order_by('pk')
+        follows = Follow.objects.filter(user__in=users).order_by(
+            'user__username', 'author__username')
+        return (
+            [(post.author.username[len(prefix):], post.text, post.pub_date)
+             for post in posts],
+            [(follow.user.username[len(prefix):],
+              follow.author.username[len(prefix):]) for follow in follows],
+        )
+
+    def test_seed_is_deterministic_and_consistent(self):
+        posts, follows = self.seed('first')
+        self.assertEqual((posts, follows), self.seed('second'))
+        self.assertEqual(len(posts), 60)
+        self.assertLessEqual(
+            max(pub_date for *_, pub_date in posts).date(), SEED_END)
+        self.assertGreater(len({pub_date for *_, pub_date in posts}), 1)
+        self.assertEqual(Comment.objects.count(), 80)
+        self.assertFalse(Post.objects.filter(text_html='').exists())
+        self.assertFalse(any(counters.repair().values()))
+        self.assertEqual(Timeline.objects.count(), sum(
+            Post.objects.filter(author=follow.author).count()
+            for follow in Follow.objects.all()))
+
+    def test_seed_refuses_taken_prefix(self):
+        User.objects.create_user(username='taken-0')
+        with self.assertRaises(CommandError):
+            call_command('seed', prefix='taken', stdout=StringIO())
+
+
+class ImportPostsCommandTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='old-author')
+        cls.group = Group.objects.create(
+            title='Старая группа', slug='old-group', description='')
+
+    def write(self, suffix, content):
+        descriptor, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_import_jsonl(self):
+        rows = [
+            {'text': 'Перенесённый пост', 'author': 'old-author',
+             'group': 'old-group', 'pub_date': '2015-03-01T12:00:00'},
+            {'text': 'Пост незнакомца', 'author': 'stranger'},
+            {'text': '', 'author': 'old-author'},
+            {'text': 5, 'author': 'old-author'},
+            {'text': 'Автор списком', 'author': ['old-author']},
+            {'text': 'Группа объектом', 'author': 'old-author',
+             'group': {'slug': 'old-group'}},
+        ]
+        path = self.write('.jsonl', '\n'.join(
+            json.dumps(row, ensure_ascii=False) for row in rows) + '\n{\n')
+        err = StringIO()
+        call_command('import_posts', path, batch_size=2, workers=1,
+                     stdout=StringIO(), stderr=err)
+        post = Post.objects.get()
+        self.assertEqual(
+            (post.author, post.group, post.pub_date.year),
+            (self.author, self.group, 2015))
+        self.assertEqual(post.text_html, '<p>Перенесённый пост</p>')
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
+        self.assertEqual(AuthorStats.objects.get(
+            user=self.author).posts_count, 1)
+        self.assertEqual(search.search('перенесённый')[0], [post])
+        self.assertEqual(err.getvalue().count('Строка'), 6)
+
+    def test_create_skips_rows_with_wrong_types(self):
+        path = self.write('.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'text': 'Автор списком', 'author': ['someone']},
+            {'text': 'Группа объектом', 'author': 'old-author',
+             'group': {'slug': 'new-group'}},
+        ]))
+        err = StringIO()
+        call_command('import_posts', path, create_authors=True,
+                     create_groups=True, skip_thumbnails=True,
+                     stdout=StringIO(), stderr=err)
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(err.getvalue().count('не строка'), 2)
+
+    @override_settings(FOLLOW_FEED='merge')
+    def test_import_reaches_cached_recent_lists(self):
+        cache.clear()
+        self.assertEqual(feeds.recent_posts([self.author.pk]), [[]])
+        path = self.write('.jsonl', json.dumps(
+            {'text': 'Из архива', 'author': 'old-author'}))
+        call_command('import_posts', path, skip_thumbnails=True,
+                     stdout=StringIO())
+        post = Post.objects.get()
+        self.assertEqual(feeds.recent_posts([self.author.pk]),
+                         [[(post.pub_date, post.pk)]])
+
+    def test_import_csv_creates_authors_and_groups(self):
+        path = self.write('.csv', 'text,author,group,pub_date\n'
+                                  'Первый,new-author,new-group,\n'
+                                  'Второй,old-author,,2016-01-01 10:00\n')
+        call_command('import_posts', path, create_authors=True,
+                     create_groups=True, skip_thumbnails=True,
+                     stdout=StringIO())
+        post = Post.objects.get(text='Первый')
+        self.assertEqual(post.author.username, 'new-author')
+        self.assertFalse(post.author.has_usable_password())
+        self.assertEqual(post.group.slug, 'new-group')
+        self.assertEqual(Post.objects.get(text='Второй').group, None)
+        self.assertFalse(any(counters.repair().values()))
+
+
+class BenchmarkCommandTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='bench-author')
+        cls.reader = User.objects.create_user(username='bench-reader')
+        group = Group.objects.create(
+            title='Группа', slug='bench-group', description='Описание')
+        post = Post.objects.create(
+            author=cls.author, text='Пост для замера', group=group)
+        Comment.objects.create(post=post, author=cls.reader, text='Да')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        descriptor, cls.baseline = tempfile.mkstemp(suffix='.json')
+        os.close(descriptor)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.baseline)
+        super().tearDownClass()
+
+    def test_benchmark_saves_and_compares_baseline(self):
+        posts = Post.objects.count()
+        call_command('benchmark', repeat=1, warmup=0, save=self.baseline,
+                     stdout=StringIO())
+        self.assertEqual(Post.objects.count(), posts)
+        with open(self.baseline) as file:
+            views = json.load(file)['views']
+        self.assertEqual(set(views), {
+            'index', 'group_posts', 'profile', 'post_detail',
+            'follow_index', 'post_create', 'add_comment'})
+        self.assertGreater(views['post_detail']['queries'], 0)
+        self.assertGreater(views['post_detail']['rows'], 0)
+        self.assertGreater(views['index']['render_ms'], 0)
+
+        views['index']['queries'] = 0
+        with open(self.baseline, 'w') as file:
+            json.dump({'views': views}, file)
+        err = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('benchmark', repeat=1, warmup=0, views=['index'],
+                         compare=self.baseline, stdout=StringIO(),
+                         stderr=err)
+        self.assertIn('index.queries', err.getvalue())
+
+    def test_write_scenarios_leave_no_cache_behind(self):
+        cache.set('benchmark-marker', 1)
+        call_command('benchmark', repeat=1, warmup=0, warm_cache=True,
+                     views=['post_create'], stdout=StringIO())
+        self.assertIsNone(cache.get('benchmark-marker'))
+
+
+class LoadTestCommandTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        call_command('seed', users=4, groups=1, posts=5, comments=2,
+                     follows=2, stdout=StringIO())
+
+    def test_sessions_report_percentiles_per_url_name(self):
+        out = StringIO()
+        # Один поток: параллельные входы на общей тестовой SQLite
+        # упираются в блокировку таблицы сессий.
+        call_command('loadtest', sessions=4, concurrency=1,
+                     mix=loadtest.scenario_mix('browse,comment'), stdout=out)
+        rows = {line.split()[0]: line.split()[1:]
+                for line in out.getvalue().splitlines()
+                if line.startswith(('posts:', 'users:'))}
+        self.assertLessEqual(
+            {'posts:index', 'posts:post_detail', 'posts:profile'}, set(rows))
+        self.assertNotIn('users:login', rows)
+        self.assertEqual({row[1] for row in rows.values()}, {'0'})
+        comments = int(rows.get('posts:add_comment', ['0'])[0])
+        self.assertEqual(Comment.objects.count(), 2 + comments)
+
+    def test_report_counts_errors_and_percentiles(self):
+        samples = [loadtest.Sample('posts:index', seconds / 1000, True)
+                   for seconds in range(1, 101)]
+        samples.append(loadtest.Sample('posts:add_comment', 0.5, False))
+        out = StringIO()
+        loadtest.Command(stdout=out).report(samples, 2)
+        rows = {line.split()[0]: line.split()[1:]
+                for line in out.getvalue().splitlines()
+                if line.startswith('posts:')}
+        self.assertEqual(rows['posts:index'],
+                         ['100', '0', '50.0', '95.0', '99.0'])
+        self.assertEqual(rows['posts:add_comment'][:2], ['1', '1'])
+        self.assertIn('50.5 запросов/с', out.getvalue())
+
+    def test_mix_and_percentiles(self):
+        self.assertEqual(loadtest.scenario_mix('browse=3,post'),
+                         {'browse': 3.0, 'post': 1.0})
+        with self.assertRaises(ValueError):
+            loadtest.scenario_mix('shopping=1')
+        ordered = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(ordered, 0.5), 50)
+        self.assertEqual(loadtest.percentile(ordered, 0.99), 99)
+        self.assertEqual(loadtest.percentile([7], 0.95), 7)
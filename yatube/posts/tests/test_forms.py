@@ -1,5 +1,8 @@
 import shutil
 import tempfile
+from hashlib import sha256
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -7,6 +10,7 @@ from django.test import TestCase, Client, override_settings
 from posts.models import Post, Group
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from PIL import Image
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -58,6 +62,15 @@ class PostFormsTests(TestCase):
         self.assertEqual(Post.objects.count(), post_count + 1)
         self.assertEqual(posts_by_id[0].text, text)
 
+    def test_failed_counter_update_rolls_back_post(self):
+        post_count = Post.objects.count()
+        with mock.patch('posts.counters.shift_author',
+                        side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.authorized_client.post(
+                    reverse('posts:post_create'), data={'text': 'Откат'})
+        self.assertEqual(Post.objects.count(), post_count)
+
     def test_edit_post(self):
         form_data = {
             'post_id': self.post.id,
@@ -151,4 +164,53 @@ class PostImageCreateTest(TestCase):
         self.assertEqual(Post.objects.count(), posts_count + 1)
         self.assertEqual(posts_by_id[0].text, text)
         self.assertEqual(posts_by_id[0].author, self.user)
-        self.assertEqual(posts_by_id[0].image, f'posts/{uploaded.name}')
+        self.assertEqual(posts_by_id[0].image,
+                         f'posts/{sha256(small_gif).hexdigest()}.gif')
+
+    @staticmethod
+    def make_jpeg(size):
+        image = Image.new('RGB', size, 'red')
+        exif = image.getexif()
+        exif[0x010F] = 'Camera maker'
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('big.jpg', buffer.getvalue(), 'image/jpeg')
+
+    @override_settings(POST_IMAGE_MAX_SIDE=300)
+    def test_form_downscales_and_strips_metadata(self):
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'большая картинка',
+                  'image': self.make_jpeg((1200, 600))},
+        )
+        self.assertEqual(response.status_code, 302)
+        post = Post.objects.get(text='большая картинка')
+        with Image.open(post.image) as stored:
+            self.assertEqual(stored.size, (300, 150))
+            self.assertIn(stored.format, settings.POST_IMAGE_FORMATS)
+            self.assertNotIn('exif', stored.info)
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=1000)
+    def test_form_rejects_too_many_pixels(self):
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'огромная картинка',
+                  'image': self.make_jpeg((100, 100))},
+        )
+        self.assertFormError(
+            response, 'form', 'image', 'Картинка слишком большая: 100×100')
+        self.assertFalse(Post.objects.filter(text='огромная картинка'))
+
+    def test_form_rejects_truncated_image(self):
+        buffer = BytesIO()
+        Image.effect_noise((400, 400), 64).convert('RGB').save(
+            buffer, 'JPEG')
+        truncated = SimpleUploadedFile(
+            'cut.jpg', buffer.getvalue()[:2000], 'image/jpeg')
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'обрезанная картинка', 'image': truncated},
+        )
+        self.assertFormError(
+            response, 'form', 'image', 'Не удалось прочитать картинку')
+        self.assertFalse(Post.objects.filter(text='обрезанная картинка'))
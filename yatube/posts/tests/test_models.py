@@ -1,7 +1,10 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 
-from ..models import Group, Post
+from ..models import AuthorStats, Comment, Follow, Group, Post
 
 User = get_user_model()
 
@@ -38,3 +41,75 @@ class PostModelTest(TestCase):
 
         expected_object_name_pub_date = post.pub_date
         self.assertEqual(expected_object_name_pub_date, post.pub_date)
+
+    def test_save_renders_text(self):
+        """При сохранении текста пересчитываются text_html и excerpt."""
+        post = Post.objects.create(author=self.user, text='<b>\nстрока')
+        self.assertEqual(post.text_html, '<p>&lt;b&gt;<br>строка</p>')
+        post.text = ' '.join(['слово'] * 40)
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertTrue(post.excerpt.endswith('…'))
+        self.assertEqual(len(post.excerpt.split()), 30)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='counted_author')
+        cls.reader = User.objects.create_user(username='counted_reader')
+        cls.group = Group.objects.create(
+            title='Группа со счётчиком',
+            slug='counted-group',
+            description='Тестовое описание',
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other-counted-group',
+            description='Тестовое описание',
+        )
+
+    def test_counters_follow_changes(self):
+        post = Post.objects.create(
+            author=self.author, text='Тестовый текст', group=self.group)
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        stats = AuthorStats.objects.get(user=self.author)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 1)
+        self.assertEqual(self.reader.stats.following_count, 1)
+
+        post.group = self.other_group
+        post.save()
+        self.group.refresh_from_db()
+        self.other_group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.other_group.posts_count, 1)
+
+        post.delete()
+        Follow.objects.all().delete()
+        stats.refresh_from_db()
+        self.other_group.refresh_from_db()
+        self.assertEqual(stats.posts_count, 0)
+        self.assertEqual(stats.followers_count, 0)
+        self.assertEqual(self.other_group.posts_count, 0)
+
+    def test_repair_counters_fixes_drift(self):
+        post = Post.objects.create(
+            author=self.author, text='Тестовый текст', group=self.group)
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        Group.objects.update(posts_count=7)
+        Post.objects.update(comments_count=0)
+        AuthorStats.objects.all().delete()
+        call_command('repair_counters', stdout=StringIO())
+        post.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 1)
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(AuthorStats.objects.get(
+            user=self.author).posts_count, 1)
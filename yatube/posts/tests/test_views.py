@@ -1,17 +1,35 @@
+import os
 import shutil
 import tempfile
+import threading
+import time
+from hashlib import sha256
+from io import BytesIO, StringIO
+from unittest import mock
 
 
 from django import forms
+from django.contrib.admin import AdminSite
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.conf import settings
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 
-from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings)
 from django.urls import reverse
+from PIL import Image
 
-from ..models import Group, Post, Comment, Follow
+from .. import caching, feeds, images, queries, resize
+from ..admin import PostAdmin
+from ..surrogate import LocalPurgeBackend
+from ..models import (
+    Comment, Follow, Group, ImageVariant, Post, StoredImage, Timeline)
+from .utils import QueryBudgetMixin
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
@@ -245,6 +263,73 @@ class PaginatorViewsTest(TestCase):
         )
         self.assertEqual(len(response.context['page_obj']), 3)
 
+    def test_cursor_pages_walk_forward_and_back(self):
+        cache.clear()
+        first_page = self.client.get(reverse('posts:index')).context[
+            'page_obj']
+        self.assertIsNone(first_page.previous_cursor)
+        response = self.client.get(
+            reverse('posts:index'), {'after': first_page.next_cursor}
+        )
+        second_page = response.context['page_obj']
+        self.assertEqual(second_page.number, 2)
+        self.assertEqual(list(second_page), self.post[2::-1])
+        self.assertIsNone(second_page.next_cursor)
+        response = self.client.get(
+            reverse('posts:index'), {'before': second_page.previous_cursor}
+        )
+        self.assertEqual(
+            list(response.context['page_obj']), list(first_page)
+        )
+
+    def test_group_pages_use_maintained_counter(self):
+        Group.objects.filter(pk=self.group.pk).update(posts_count=95)
+        response = self.client.get(
+            reverse('posts:group_posts', args=[self.group.slug]))
+        self.assertEqual(
+            response.context['page_obj'].paginator.num_pages, 10)
+
+    def test_page_links_are_elided(self):
+        Group.objects.filter(pk=self.group.pk).update(posts_count=10 ** 6)
+        response = self.client.get(
+            reverse('posts:group_posts', args=[self.group.slug]),
+            {'page': 500}
+        )
+        paginator = response.context['page_obj'].paginator
+        self.assertEqual(
+            list(paginator.get_elided_page_range(500)),
+            [1, '…', 498, 499, 500, 501, 502, '…', 100000]
+        )
+        self.assertEqual(
+            list(paginator.get_elided_page_range(2)),
+            [1, 2, 3, 4, '…', 100000]
+        )
+        self.assertLess(response.content.decode().count('page-item'), 15)
+
+    @override_settings(PAGINATOR_EXACT_COUNT_LIMIT=5)
+    def test_large_counts_are_cached(self):
+        cache.clear()
+        response = self.client.get(reverse('posts:index'))
+        self.assertEqual(response.context['page_obj'].paginator.count, 13)
+        Post.objects.create(text='Лишний пост', author=self.user)
+        response = self.client.get(reverse('posts:index'))
+        self.assertEqual(response.context['page_obj'].paginator.count, 13)
+
+    def test_small_counts_are_exact(self):
+        cache.clear()
+        self.client.get(reverse('posts:index'))
+        Post.objects.create(text='Лишний пост', author=self.user)
+        response = self.client.get(reverse('posts:index'))
+        self.assertEqual(response.context['page_obj'].paginator.count, 14)
+
+    def test_invalid_cursor_shows_first_page(self):
+        response = self.client.get(
+            reverse('posts:group_posts', args=[self.group.slug]),
+            {'after': 'not-a-cursor'}
+        )
+        self.assertEqual(response.context['page_obj'].number, 1)
+        self.assertEqual(len(response.context['page_obj']), 10)
+
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostImageExistTest(TestCase):
@@ -264,6 +349,8 @@ class PostImageExistTest(TestCase):
             content=small_gif,
             content_type='image/gif'
         )
+        cls.small_gif = small_gif
+        cls.image_name = f'posts/{sha256(small_gif).hexdigest()}.gif'
         cls.user = User.objects.create_user(username='author')
         cls.group = Group.objects.create(
             title='Тестовый тайтл',
@@ -276,6 +363,8 @@ class PostImageExistTest(TestCase):
             group=cls.group,
             image=uploaded,
         )
+        # В TestCase on_commit не срабатывает, нарезаем сами.
+        images.build(cls.image_name)
 
     @classmethod
     def tearDownClass(cls):
@@ -287,14 +376,14 @@ class PostImageExistTest(TestCase):
         self.author_client.force_login(self.user)
 
     def test_post_with_image_exist(self):
-        self.assertTrue(Post.objects.filter(image='posts/small.gif'))
+        self.assertTrue(Post.objects.filter(image=self.image_name))
 
     def test_index_show_correct_image_in_context(self):
         cache.clear()
         response = self.author_client.get(reverse('posts:index'))
         test_object = response.context['page_obj'][0]
         post_image = test_object.image
-        self.assertEqual(post_image, 'posts/small.gif')
+        self.assertEqual(post_image, self.image_name)
 
     def test_post_detail_image_exist(self):
         response = self.author_client.get(
@@ -302,7 +391,7 @@ class PostImageExistTest(TestCase):
         )
         test_object = response.context['post']
         post_image = test_object.image
-        self.assertEqual(post_image, 'posts/small.gif')
+        self.assertEqual(post_image, self.image_name)
 
     def test_group_and_profile_image_exist(self):
         templates_pages_name = {
@@ -314,7 +403,216 @@ class PostImageExistTest(TestCase):
                 response = self.author_client.get(reverse(names, args=[args]))
                 test_object = response.context['page_obj'][0]
                 post_image = test_object.image
-                self.assertEqual(post_image, 'posts/small.gif')
+                self.assertEqual(post_image, self.image_name)
+
+    def test_index_uses_pregenerated_variant(self):
+        variant = ImageVariant.objects.get(source=self.image_name)
+        self.assertEqual((variant.width, variant.height), (960, 339))
+        images.render_all(variant.source)
+        self.assertTrue(default_storage.exists(variant.name))
+        cache.clear()
+        response = self.author_client.get(reverse('posts:index'))
+        self.assertContains(response, variant.url)
+        self.assertContains(response, 'width="960" height="339"')
+
+    def test_failed_render_falls_back_to_resize(self):
+        with mock.patch.object(images, 'fit', side_effect=OSError):
+            images.build(self.image_name)
+        self.assertFalse(
+            ImageVariant.objects.filter(source=self.image_name).exists())
+        cache.clear()
+        response = self.author_client.get(reverse('posts:index'))
+        self.assertContains(
+            response, resize.resized_url(self.image_name, 960, 339))
+
+    def test_page_resolves_variants_in_one_query(self):
+        for number in range(3):
+            Post.objects.create(
+                text=f'Ещё пост {number}',
+                author=self.user,
+                image=f'posts/other-{number}.gif',
+            )
+            images.register(f'posts/other-{number}.gif')
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.author_client.get(reverse('posts:index'))
+        lookups = [query for query in queries.captured_queries
+                   if 'posts_imagevariant' in query['sql']]
+        self.assertEqual(len(lookups), 1)
+        self.assertContains(response, 'variants/card/posts/other-2.jpg')
+
+    def test_backfill_thumbnails_renders_missing_and_resumes(self):
+        variant = ImageVariant.objects.get(source=self.image_name)
+        default_storage.delete(variant.name)
+        checkpoint = os.path.join(TEMP_MEDIA_ROOT, 'backfill.checkpoint')
+        with open(checkpoint, 'w') as file:
+            file.write(str(self.post.pk - 1))
+        out = StringIO()
+        call_command('backfill_thumbnails', workers=1,
+                     checkpoint=checkpoint, stdout=out)
+        self.assertIn('нарезано 1', out.getvalue())
+        self.assertTrue(default_storage.exists(variant.name))
+        self.assertFalse(os.path.exists(checkpoint))
+        with open(checkpoint, 'w') as file:
+            file.write(str(self.post.pk))
+        out = StringIO()
+        call_command('backfill_thumbnails', workers=1, force=True,
+                     checkpoint=checkpoint, stdout=out)
+        self.assertIn('нарезано 0', out.getvalue())
+
+    def test_placeholder_is_stored_and_rendered_lazily(self):
+        placeholder = self.post.image_placeholder
+        self.assertTrue(placeholder.startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(placeholder), 1000)
+        cache.clear()
+        response = self.author_client.get(reverse('posts:index'))
+        self.assertContains(response, placeholder)
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_backfill_fills_missing_placeholders(self):
+        Post.objects.update(image_placeholder='')
+        call_command('backfill_thumbnails', workers=1, stdout=StringIO())
+        self.assertEqual(Post.objects.get(pk=self.post.pk).image_placeholder,
+                         self.post.image_placeholder)
+
+    def test_duplicate_uploads_share_one_file(self):
+        green_gif = self.small_gif.replace(b'\xFF\xFF\xFF', b'\x00\xFF\x00')
+        name = f'posts/{sha256(green_gif).hexdigest()}.gif'
+        first, copy = (
+            Post.objects.create(
+                text=f'Та же картинка {number}',
+                author=self.user,
+                image=SimpleUploadedFile(filename, green_gif),
+            )
+            for number, filename in enumerate(('green.gif', 'copy.GIF'))
+        )
+        self.assertEqual(copy.image.name, name)
+        self.assertEqual(StoredImage.objects.get(name=name).refs, 2)
+        images.build(name)
+        self.assertEqual(ImageVariant.objects.filter(source=name).count(), 1)
+        copy.delete()
+        images.collect(name)
+        self.assertTrue(copy.image.storage.exists(name))
+        first.delete()
+        images.collect(name)
+        self.assertFalse(copy.image.storage.exists(name))
+        self.assertFalse(StoredImage.objects.filter(name=name).exists())
+        self.assertFalse(ImageVariant.objects.filter(source=name).exists())
+
+    def test_reupload_survives_collect_of_released_file(self):
+        red_gif = self.small_gif.replace(b'\xFF\xFF\xFF', b'\xFF\x00\x00')
+        name = f'posts/{sha256(red_gif).hexdigest()}.gif'
+        Post.objects.create(text='Первая загрузка', author=self.user,
+                            image=SimpleUploadedFile('red.gif', red_gif)
+                            ).delete()
+        storage = images.source_storage()
+        exists = storage.exists
+
+        def exists_then_collect(path):
+            # Отложенный collect удалённого поста успевает выполниться
+            # между проверкой файла и сохранением нового поста.
+            found = exists(path)
+            images.collect(path)
+            return found
+
+        with mock.patch.object(storage, 'exists', exists_then_collect):
+            post = Post.objects.create(
+                text='Повторная загрузка', author=self.user,
+                image=SimpleUploadedFile('again.gif', red_gif))
+        self.assertEqual(post.image.name, name)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(StoredImage.objects.get(name=name).refs, 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT,
+                   RESIZE_CACHE_ROOT=os.path.join(TEMP_MEDIA_ROOT, 'resize'))
+class ResizeTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        buffer = BytesIO()
+        Image.new('RGB', (80, 40), 'blue').save(buffer, 'PNG')
+        cls.post = Post.objects.create(
+            text='Пост для ресайза',
+            author=User.objects.create_user(username='resizer'),
+            image=SimpleUploadedFile('blue.png', buffer.getvalue()),
+        )
+        cls.path = cls.post.image.name
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        shutil.rmtree(settings.RESIZE_CACHE_ROOT, ignore_errors=True)
+
+    def test_signed_url_returns_cacheable_resized_image(self):
+        response = self.client.get(resize.resized_url(self.path, 30, 20))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn(f'max-age={settings.RESIZE_MAX_AGE}',
+                      response['Cache-Control'])
+        content = BytesIO(b''.join(response.streaming_content))
+        with Image.open(content) as image:
+            self.assertEqual(image.size, (30, 20))
+
+    def test_wrong_signature_or_size_is_not_found(self):
+        url = resize.resized_url(self.path, 30, 20)
+        for bad in (url.replace('30x20', '31x20'),
+                    resize.resized_url(self.path, 0, 20),
+                    resize.resized_url(self.path, 5000, 20)):
+            with self.subTest(url=bad):
+                self.assertEqual(self.client.get(bad).status_code, 404)
+
+    def test_concurrent_requests_resize_once(self):
+        calls = []
+
+        def slow_fit(*args):
+            calls.append(args)
+            time.sleep(0.05)
+            return fit(*args)
+
+        fit = images.fit
+        with mock.patch.object(images, 'fit', slow_fit):
+            workers = [threading.Thread(
+                target=resize.get, args=(30, 20, self.path))
+                for _ in range(4)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_evicted_before_open_is_resized_again(self):
+        targets = []
+
+        def get_then_evict(*args):
+            target = get(*args)
+            if not targets:
+                os.remove(target)
+            targets.append(target)
+            return target
+
+        get = resize.get
+        with mock.patch.object(resize, 'get', get_then_evict):
+            response = self.client.get(resize.resized_url(self.path, 30, 20))
+            self.assertEqual(response.status_code, 200)
+            response.close()
+        self.assertEqual(len(targets), 2)
+
+    def test_cache_size_is_tracked_without_scanning(self):
+        resize.get(30, 20, self.path)
+        with mock.patch.object(resize, '_entries') as entries:
+            resize.get(40, 20, self.path)
+        entries.assert_not_called()
+
+    @override_settings(RESIZE_CACHE_MAX_BYTES=1)
+    def test_cache_evicts_least_recently_used(self):
+        first = resize.get(30, 20, self.path)
+        second = resize.get(40, 20, self.path)
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
 
 
 class CommentTest(TestCase):
@@ -399,13 +697,285 @@ class CacheTest(TestCase):
         response = self.client.get(reverse('posts:index'))
         content = response.content
         self.assertIn(self.post, response.context['page_obj'])
-        self.post.delete()
+        Post.objects.filter(pk=self.post.pk).update(
+            text='Мимо сигналов', text_html='<p>Мимо сигналов</p>')
         response = self.client.get(reverse('posts:index'))
         self.assertEqual(content, response.content)
         cache.clear()
         response = self.client.get(reverse('posts:index'))
         self.assertNotEqual(content, response.content)
 
+    def test_changes_expire_cached_pages(self):
+        cache.clear()
+        group = Group.objects.create(
+            title='Группа', slug='cached-group', description='Описание')
+        pages = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', args=[group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+        )
+        for page in pages:
+            self.client.get(page)
+        new_post = Post.objects.create(
+            author=self.author, text='Свежий пост', group=group)
+        for page in pages:
+            with self.subTest(page=page):
+                response = self.client.get(page)
+                self.assertIn(new_post, response.context['page_obj'])
+        new_post.delete()
+        for page in pages:
+            with self.subTest(page=page):
+                response = self.client.get(page)
+                self.assertNotIn(new_post, response.context['page_obj'])
+
+    def test_unchanged_pages_answer_not_modified(self):
+        cache.clear()
+        pages = (
+            reverse('posts:index'),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.pk]),
+        )
+        for page in pages:
+            with self.subTest(page=page):
+                tag = self.client.get(page)['ETag']
+                response = self.client.get(page, HTTP_IF_NONE_MATCH=tag)
+                self.assertEqual(response.status_code, 304)
+                other_page = self.client.get(
+                    page, {'page': 2}, HTTP_IF_NONE_MATCH=tag)
+                self.assertEqual(other_page.status_code, 200)
+        tags = [self.client.get(page)['ETag'] for page in pages]
+        Comment.objects.create(post=self.post, author=self.author, text='Да')
+        for page, tag in zip(pages, tags):
+            with self.subTest(page=page):
+                response = self.client.get(page, HTTP_IF_NONE_MATCH=tag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_renames_expire_pages_under_old_urls(self):
+        cache.clear()
+        group = Group.objects.create(
+            title='Группа', slug='old', description='Описание')
+        author = User.objects.create_user(username='old-name')
+        old_pages = (reverse('posts:group_posts', args=['old']),
+                     reverse('posts:profile', args=['old-name']))
+        for page in old_pages:
+            self.assertEqual(self.client.get(page).status_code, 200)
+        group.slug = 'new'
+        group.save()
+        author.username = 'new-name'
+        author.save()
+        for page in old_pages:
+            with self.subTest(page=page):
+                self.assertEqual(self.client.get(page).status_code, 404)
+
+    def test_group_change_expires_post_and_profile(self):
+        cache.clear()
+        group = Group.objects.create(
+            title='Старая группа', slug='old-slug', description='Описание')
+        post = Post.objects.create(
+            author=self.author, text='Пост в группе', group=group)
+        pages = (
+            reverse('posts:post_detail', args=[post.pk]),
+            reverse('posts:profile', args=[self.author.username]),
+        )
+        tags = [self.client.get(page)['ETag'] for page in pages]
+        group.slug = 'new-slug'
+        group.save()
+        for page, tag in zip(pages, tags):
+            with self.subTest(page=page):
+                response = self.client.get(page, HTTP_IF_NONE_MATCH=tag)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(
+                    response, reverse('posts:group_posts', args=['new-slug']))
+
+
+class CardCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(
+            username='card-author', first_name='Старое', last_name='Имя')
+        cls.group = Group.objects.create(
+            title='Группа', slug='card-group', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.author, text='Текст карточки', group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_page_reads_all_cards_with_one_get_many(self):
+        Post.objects.create(author=self.author, text='Вторая карточка')
+        self.client.get(reverse('posts:index'))
+        caching.bump('feed')
+        with mock.patch.object(
+                cache, 'get_many', wraps=cache.get_many) as get_many:
+            self.client.get(reverse('posts:index'))
+        card_reads = [call for call in get_many.call_args_list
+                      if any(key.startswith('card:') for key in call[0][0])]
+        self.assertEqual(len(card_reads), 1)
+        self.assertEqual(len(card_reads[0][0][0]), 2)
+
+    def test_cards_follow_post_and_author_changes(self):
+        url = reverse('posts:index')
+        self.client.get(url)
+        Post.objects.filter(pk=self.post.pk).update(text='Мимо сигналов')
+        caching.bump('feed')
+        self.assertContains(self.client.get(url), 'Текст карточки')
+        post = Post.objects.get(pk=self.post.pk)
+        post.save()
+        self.assertContains(self.client.get(url), 'Мимо сигналов')
+        self.author.first_name = 'Новое'
+        self.author.save()
+        self.assertContains(self.client.get(url), 'Новое Имя')
+
+    def test_author_rename_expires_pages_and_etags(self):
+        pages = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+        )
+        tags = [self.client.get(page)['ETag'] for page in pages]
+        author = User.objects.get(pk=self.author.pk)
+        author.last_name = 'Переименованный'
+        author.save()
+        for page, tag in zip(pages, tags):
+            with self.subTest(page=page):
+                response = self.client.get(page, HTTP_IF_NONE_MATCH=tag)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'Старое Переименованный')
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.authors = [User.objects.create_user(username=f'budget-{i}')
+                       for i in range(3)]
+        groups = [Group.objects.create(title=f'Группа {i}',
+                                       slug=f'budget-{i}',
+                                       description='Описание')
+                  for i in range(3)]
+        for i in range(12):
+            cls.post = Post.objects.create(
+                author=cls.authors[i % 3], text=f'Пост {i}',
+                group=groups[i % 3] if i % 4 else None)
+        for author in cls.authors:
+            Comment.objects.create(post=cls.post, author=author, text='Да')
+            Follow.objects.create(user=cls.authors[0], author=author)
+        cls.group = groups[0]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.authors[0])
+
+    def test_pages_fit_budget_without_n_plus_one(self):
+        pages = {
+            'posts:index': [],
+            'posts:group_posts': [self.group.slug],
+            'posts:profile': [self.authors[1].username],
+            'posts:post_detail': [self.post.pk],
+            'posts:follow_index': [],
+        }
+        for name, args in pages.items():
+            with self.subTest(page=name):
+                with self.assertQueryBudget(name):
+                    self.client.get(reverse(name, args=args))
+
+    def test_recorder_points_at_template_line(self):
+        with queries.recording() as recorder:
+            self.client.get(
+                reverse('posts:post_detail', args=[self.post.pk]))
+            Post.objects.get(pk=self.post.pk).author
+        self.assertEqual(recorder.repeated(), [])
+        sources = {query.source for query in recorder.queries}
+        self.assertIn(None, sources)
+        self.assertTrue(any(
+            source and source.startswith('posts/post_detail.html:')
+            for source in sources))
+
+    def test_middleware_enforces_budget(self):
+        url = reverse('posts:index')
+        with override_settings(QUERY_BUDGETS={'posts:index': 1}):
+            with self.assertRaises(queries.QueryBudgetExceeded):
+                self.client.get(url)
+            cache.clear()
+            with override_settings(QUERY_BUDGET_STRICT=False):
+                with self.assertLogs('posts.queries', 'ERROR'):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_middleware_logs_n_plus_one(self):
+        posts = Post.objects.filter(author=self.authors[0])
+        with queries.recording() as recorder:
+            for post in posts:
+                post.author.username
+        with self.assertLogs('posts.queries', 'WARNING') as logs:
+            queries.QueryBudgetMiddleware.check('/', None, recorder)
+        self.assertIn('N+1', logs.output[0])
+
+
+class SurrogateKeyTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='edge-author')
+        self.group = Group.objects.create(
+            title='Группа', slug='edge-group', description='Описание')
+        self.post = Post.objects.create(
+            author=self.author, text='Пост на краю', group=self.group)
+        LocalPurgeBackend.purged.clear()
+
+    def test_responses_are_tagged(self):
+        post_keys = {f'post-{self.post.pk}', f'author-{self.author.pk}'}
+        pages = {
+            reverse('posts:index'): {'feed'},
+            reverse('posts:group_posts', args=[self.group.slug]): {
+                'group-edge-group'},
+            reverse('posts:profile', args=[self.author.username]): set(),
+            reverse('posts:post_detail', args=[self.post.pk]): {
+                'group-edge-group'},
+        }
+        for page, keys in pages.items():
+            with self.subTest(page=page):
+                response = self.client.get(page)
+                self.assertLessEqual(
+                    post_keys | keys,
+                    set(response[settings.SURROGATE_KEY_HEADER].split()))
+                self.assertIn('max-age', response['Surrogate-Control'])
+
+    def test_group_rename_purges_old_slug(self):
+        self.group.slug = 'renamed-edge-group'
+        self.group.save()
+        self.assertLessEqual({'group-edge-group', 'group-renamed-edge-group'},
+                             set(LocalPurgeBackend.purged))
+
+    def test_follow_feed_stays_out_of_edge_cache(self):
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertFalse(response.has_header('Surrogate-Control'))
+        self.assertFalse(response.has_header(settings.SURROGATE_KEY_HEADER))
+
+    def test_changes_purge_keys_after_commit(self):
+        Comment.objects.create(post=self.post, author=self.author, text='!')
+        self.assertIn(f'post-{self.post.pk}', LocalPurgeBackend.purged)
+        LocalPurgeBackend.purged.clear()
+        post_id = self.post.pk
+        self.post.delete()
+        self.assertLessEqual(
+            {'feed', f'post-{post_id}', f'author-{self.author.pk}',
+             'group-edge-group'},
+            set(LocalPurgeBackend.purged))
+
+    @override_settings(PURGE_BACKEND='posts.surrogate.HttpPurgeBackend',
+                       PURGE_URL='http://cache.local/purge')
+    def test_http_backend_sends_keys(self):
+        with mock.patch('posts.surrogate.requests.request') as request:
+            Follow.objects.create(
+                user=User.objects.create_user(username='reader'),
+                author=self.author)
+        method, url = request.call_args[0]
+        self.assertEqual((method, url), ('PURGE', 'http://cache.local/purge'))
+        self.assertIn(f'author-{self.author.pk}',
+                      request.call_args[1]['headers']['Surrogate-Key'])
+
 
 class FollowTest(TestCase):
 
@@ -459,3 +1029,174 @@ class FollowTest(TestCase):
         response_not_follower = self.not_follower_client.get(reverse_name)
         self.assertEqual(response_follower.context['page_obj'][0], self.post)
         self.assertNotEqual(len(response_not_follower.context), 0)
+
+    def test_timeline_follows_posts_and_subscriptions(self):
+        Follow.objects.create(author=self.author, user=self.follower)
+        new_post = Post.objects.create(
+            text='Новый пост для ленты',
+            author=self.author,
+        )
+        self.assertEqual(
+            list(Timeline.objects.filter(
+                user=self.follower).values_list('post', flat=True)),
+            [new_post.pk, self.post.pk]
+        )
+        self.assertFalse(Timeline.objects.filter(user=self.not_follower))
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']), [new_post, self.post]
+        )
+        self.follower_client.get(
+            reverse('posts:profile_unfollow', kwargs={'username': self.author})
+        )
+        self.assertFalse(Timeline.objects.filter(user=self.follower))
+
+
+@override_settings(FOLLOW_FEED='merge')
+class MergedFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.follower = User.objects.create(username='MergeFollower')
+        cls.authors = [
+            User.objects.create(username=f'MergeAuthor{i}') for i in range(3)
+        ]
+        for author in cls.authors[:2]:
+            Follow.objects.create(user=cls.follower, author=author)
+        cls.posts = [
+            Post.objects.create(
+                text=f'Пост {i}', author=cls.authors[i % 3]
+            )
+            for i in range(21)
+        ]
+        cls.expected = [
+            post for post in reversed(cls.posts)
+            if post.author != cls.authors[2]
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.follower_client = Client()
+        self.follower_client.force_login(self.follower)
+
+    def walk_feed(self):
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        first_page = response.context['page_obj']
+        response = self.follower_client.get(
+            reverse('posts:follow_index'), {'after': first_page.next_cursor}
+        )
+        second_page = response.context['page_obj']
+        self.assertIsNone(second_page.next_cursor)
+        response = self.follower_client.get(
+            reverse('posts:follow_index'),
+            {'before': second_page.previous_cursor}
+        )
+        self.assertEqual(list(response.context['page_obj']), list(first_page))
+        return list(first_page) + list(second_page)
+
+    def test_merged_feed_matches_followed_posts(self):
+        self.assertEqual(self.walk_feed(), self.expected)
+        self.assertFalse(Timeline.objects.exists())
+
+    def test_new_post_reaches_cached_lists(self):
+        self.walk_feed()
+        new_post = Post.objects.create(text='Свежий', author=self.authors[0])
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.context['page_obj'][0], new_post)
+
+    @override_settings(FEED_RECENT_POSTS=3)
+    def test_pages_beyond_cached_lists_fall_back_to_database(self):
+        self.assertEqual(self.walk_feed(), self.expected)
+
+    @override_settings(FEED_RECENT_POSTS=3)
+    def test_recent_lists_are_built_in_one_query(self):
+        author_ids = [author.pk for author in self.authors]
+        with self.assertNumQueries(1):
+            lists = feeds.recent_posts(author_ids)
+        self.assertEqual(lists, [
+            [(post.pub_date, post.pk) for post in reversed(self.posts)
+             if post.author == author][:3]
+            for author in self.authors
+        ])
+        with self.assertNumQueries(0):
+            self.assertEqual(feeds.recent_posts(author_ids), lists)
+
+
+class FeedQueryPlanTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create(username='PlannedAuthor')
+        cls.group = Group.objects.create(
+            title='Группа', slug='planned', description='Описание')
+        Post.objects.create(text='Пост', author=cls.author, group=cls.group)
+
+    def test_feed_pages_use_feed_indexes(self):
+        out = StringIO()
+        call_command('explain_feeds', stdout=out)
+        plans = out.getvalue()
+        for index in ('post_pub_date_idx', 'post_group_date_idx',
+                      'post_author_date_idx', 'comment_post_created_idx',
+                      'timeline_user_date_idx'):
+            with self.subTest(index=index):
+                self.assertIn(index, plans)
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='searcher')
+        cls.posts = [
+            Post.objects.create(
+                text=f'Заметка номер {i} про котиков <b>и</b> собак',
+                author=cls.author,
+            )
+            for i in range(12)
+        ]
+        cls.other = Post.objects.create(
+            text='Совсем другая история', author=cls.author)
+
+    def test_search_pages_through_matches(self):
+        response = self.client.get(reverse('posts:search'), {'q': 'котиков'})
+        first_page = response.context['posts']
+        self.assertEqual(len(first_page), 10)
+        self.assertIn('<mark>котиков</mark>', response.content.decode())
+        self.assertNotIn('<b>и</b>', response.content.decode())
+        response = self.client.get(reverse('posts:search'), {
+            'q': 'котиков', 'after': response.context['next_cursor']})
+        second_page = response.context['posts']
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertCountEqual(first_page + second_page, self.posts)
+
+    def test_index_follows_edits_and_deletes(self):
+        post = Post.objects.get(pk=self.posts[0].pk)
+        post.text = 'Теперь про попугаев'
+        post.save()
+        response = self.client.get(reverse('posts:search'), {'q': 'попугаев'})
+        self.assertEqual(response.context['posts'], [post])
+        post.delete()
+        response = self.client.get(reverse('posts:search'), {'q': 'попугаев'})
+        self.assertEqual(response.context['posts'], [])
+
+    def test_admin_search_uses_index(self):
+        admin = PostAdmin(Post, AdminSite())
+        queryset, distinct = admin.get_search_results(
+            None, Post.objects.all(), 'история')
+        self.assertEqual(list(queryset), [self.other])
+        self.assertFalse(distinct)
+
+    def test_query_operators_are_not_interpreted(self):
+        response = self.client.get(
+            reverse('posts:search'), {'q': 'история OR "котиков'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['posts'], [])
+
+    def test_rebuild_search_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_post_fts')
+        out = StringIO()
+        call_command('rebuild_search_index', batch_size=5, stdout=out)
+        self.assertIn('13', out.getvalue())
+        response = self.client.get(reverse('posts:search'), {'q': 'история'})
+        self.assertEqual(response.context['posts'], [self.other])
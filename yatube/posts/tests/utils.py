@@ -0,0 +1,19 @@
+from contextlib import contextmanager
+
+from .. import queries
+
+
+class QueryBudgetMixin:
+    @contextmanager
+    def assertQueryBudget(self, view_name=None, limit=None):
+        """Без N+1 и не больше limit запросов (или бюджета из настроек)."""
+        with queries.recording() as recorder:
+            yield recorder
+        for sql, count, source in recorder.repeated():
+            self.fail(f'N+1: {count} раз из {source}: {sql}')
+        if limit is None:
+            limit = queries.budget(view_name)
+        if limit is not None:
+            self.assertLessEqual(
+                len(recorder), limit,
+                '\n'.join(query.sql for query in recorder.queries))
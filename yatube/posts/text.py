@@ -0,0 +1,14 @@
+"""HTML текста поста, который считается при сохранении, а не в шаблонах."""
+from django.utils.html import escape, linebreaks
+from django.utils.text import Truncator, normalize_newlines
+
+EXCERPT_WORDS = 30
+
+
+def to_html(text):
+    return linebreaks(text, autoescape=True)
+
+
+def to_excerpt(text):
+    short = Truncator(text).words(EXCERPT_WORDS)
+    return escape(normalize_newlines(short)).replace('\n', '<br>')
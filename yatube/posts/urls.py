@@ -18,6 +18,12 @@ urlpatterns = [
         name='add_comment'
     ),
     path('follow/', views.follow_index, name='follow_index'),
+    path('search/', views.search_posts, name='search'),
+    path(
+        'media/resize/<str:signature>/<int:width>x<int:height>/<path:path>',
+        views.resize_image,
+        name='resize_image'
+    ),
     path(
         'profile/<str:username>/follow/',
         views.profile_follow,
@@ -1,11 +1,164 @@
+import base64
+import binascii
+from hashlib import md5
+
 from django.conf import settings
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация ленты по паре (pub_date, id).
+
+    Страница по курсору ``?after=``/``?before=`` стоит один запрос
+    с LIMIT, независимо от её номера. Старые ссылки ``?page=``
+    по-прежнему работают через OFFSET.
+
+    Общее число записей берётся из переданного ``count`` (поддерживаемые
+    счётчики), для небольших выборок считается точно, а для больших
+    кэшируется на PAGINATOR_COUNT_TIMEOUT секунд.
+    """
+
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(
+            object_list.order_by('-pub_date', '-pk'), per_page, **kwargs
+        )
+        self.known_count = count
+
+    @cached_property
+    def count(self):
+        if self.known_count is not None:
+            return self.known_count
+        limit = settings.PAGINATOR_EXACT_COUNT_LIMIT
+        head = self.object_list.order_by().values('pk')[:limit + 1].count()
+        if head <= limit:
+            return head
+        query = str(self.object_list.order_by().query).encode()
+        return cache.get_or_set(
+            f'paginator:count:{md5(query).hexdigest()}',
+            self.object_list.count,
+            settings.PAGINATOR_COUNT_TIMEOUT,
+        )
+
+    @staticmethod
+    def encode_cursor(post, number):
+        raw = f'{post.pub_date.isoformat()}|{post.pk}|{number}'
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(token):
+        padded = token + '=' * (-len(token) % 4)
+        try:
+            raw = base64.urlsafe_b64decode(padded.encode()).decode()
+            pub_date, pk, number = raw.split('|')
+            pub_date = parse_datetime(pub_date)
+            if pub_date is None:
+                raise ValueError(raw)
+            return pub_date, int(pk), max(int(number), 1)
+        except (ValueError, binascii.Error, UnicodeError) as error:
+            raise InvalidCursor(token) from error
+
+    def get_page(self, number=None, after=None, before=None):
+        try:
+            if before:
+                return self._before_page(*self.decode_cursor(before))
+            if after:
+                return self._after_page(*self.decode_cursor(after))
+        except InvalidCursor:
+            return self._after_page(None, None, 0)
+        if number is None:
+            return self._after_page(None, None, 0)
+        page = super().get_page(number)
+        page.object_list = list(page.object_list)
+        return self._with_cursors(
+            page, page.has_previous(), page.has_next()
+        )
+
+    @staticmethod
+    def keyset_filter(rows, pub_date, pk, newer):
+        # Избыточное условие по диапазону pub_date даёт базе пройти
+        # по индексу ленты, а не разбирать OR через сортировку.
+        if newer:
+            return rows.filter(pub_date__gte=pub_date).filter(
+                Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk))
+        return rows.filter(pub_date__lte=pub_date).filter(
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk))
+
+    def _after_page(self, pub_date, pk, number):
+        rows = self.object_list
+        if pk is not None:
+            rows = self.keyset_filter(rows, pub_date, pk, newer=False)
+        rows = list(rows[:self.per_page + 1])
+        if not rows and number:
+            return self._after_page(None, None, 0)
+        page = self._get_page(rows[:self.per_page], number + 1, self)
+        return self._with_cursors(
+            page, number > 0, len(rows) > self.per_page
+        )
+
+    def _before_page(self, pub_date, pk, number):
+        rows = list(self.keyset_filter(
+            self.object_list, pub_date, pk, newer=True
+        ).reverse()[:self.per_page + 1])
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page][::-1]
+        number = max(number - 1, 2) if has_previous else 1
+        page = self._get_page(rows, number, self)
+        return self._with_cursors(page, has_previous, True)
+
+    def get_elided_page_range(self, number=1, on_each_side=2, on_ends=1):
+        """Окно номеров страниц: края и соседи текущей, между ними ELLIPSIS.
+
+        Размер окна не зависит от числа страниц, в отличие от page_range.
+        """
+        last = self.num_pages
+        number = min(max(int(number), 1), last)
+        if last <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > on_each_side + on_ends + 2:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < last - on_each_side - on_ends - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(last - on_ends + 1, last + 1)
+        else:
+            yield from range(number + 1, last + 1)
+
+    def _with_cursors(self, page, has_previous, has_next):
+        rows = page.object_list
+        page.previous_cursor = (
+            self.encode_cursor(rows[0], page.number)
+            if rows and has_previous else None
+        )
+        page.next_cursor = (
+            self.encode_cursor(rows[-1], page.number)
+            if rows and has_next else None
+        )
+        return page
 
 
-def page_context(request, queryset):
-    paginator = Paginator(queryset, settings.PAGINATOR_POST_COUNT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+def page_context(request, queryset, count=None):
+    paginator = CursorPaginator(
+        queryset, settings.PAGINATOR_POST_COUNT, count=count)
+    page_obj = paginator.get_page(
+        request.GET.get('page'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
     context = {
         'page_obj': page_obj,
     }
@@ -1,67 +1,92 @@
+from . import images, resize, search, surrogate
+from .caching import etag, scope_etag, versioned_cache_page
+from .counters import author_stats
+from .feeds import follow_page_context
 from .utils import page_context
-from django.conf import settings
 
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404
 from django.shortcuts import redirect, render, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.views.decorators.cache import cache_page
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 
 from .forms import PostForm, CommentForm
 from .models import Post, Group, Follow
-from django.core.paginator import Paginator
-
-
-def pagination(request, posts):
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return(page_obj)
 
 
-@cache_page(20)
+@condition(etag_func=scope_etag('feed'))
+@versioned_cache_page(settings.PAGE_CACHE_TIMEOUT, 'feed')
 def index(request):
-    post_list = Post.objects.select_related().all()
-    paginator = Paginator(post_list, settings.PAGINATOR_POST_COUNT)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    index = True
-    context = {
-        'page_obj': page_obj,
-        'index': index,
-    }
-    return render(request, 'posts/index.html', context)
+    post_list = Post.objects.select_related('author', 'group').defer('text')
+    context = page_context(request, post_list)
+    images.attach_variants(context['page_obj'])
+    context.update(index=True)
+    response = render(request, 'posts/index.html', context)
+    return surrogate.tag(
+        response, 'feed', *surrogate.post_keys(context['page_obj']))
 
 
+@condition(etag_func=scope_etag('group:{slug}'))
+@versioned_cache_page(settings.PAGE_CACHE_TIMEOUT, 'group:{slug}')
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    context = page_context(request, group.posts.all())
+    context = page_context(
+        request, group.posts.select_related('author').defer('text'),
+        count=group.posts_count)
+    images.attach_variants(context['page_obj'])
     context.update(group=group)
-    return render(request, 'posts/group_list.html', context)
+    response = render(request, 'posts/group_list.html', context)
+    return surrogate.tag(response, f'group-{group.slug}',
+                         *surrogate.post_keys(context['page_obj']))
 
 
+@condition(etag_func=scope_etag('author:{username}'))
+@versioned_cache_page(settings.PAGE_CACHE_TIMEOUT, 'author:{username}')
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    page_obj = pagination(request, posts)
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
+    posts = author.posts.select_related('group').defer('text')
     following = (request.user.is_authenticated
                  and request.user != author
                  and Follow.objects.filter(
                      user=request.user,
                      author=author).exists())
-    context = {
-        'page_obj': page_obj,
-        'author': author,
-        'following': following
-    }
-    return render(request, 'posts/profile.html', context)
-
-
+    stats = author_stats(author)
+    context = page_context(request, posts, count=stats.posts_count)
+    images.attach_variants(context['page_obj'])
+    context.update(
+        author=author,
+        following=following,
+        stats=stats,
+        number_of_posts=stats.posts_count,
+    )
+    response = render(request, 'posts/profile.html', context)
+    return surrogate.tag(response, f'author-{author.pk}',
+                         *surrogate.post_keys(context['page_obj']))
+
+
+def post_detail_etag(request, post_id):
+    # Страница показывает и счётчик постов автора, и группу, поэтому
+    # кроме версии поста учитываем их версии; всё одним запросом по ключу.
+    username, group_id = Post.objects.filter(pk=post_id).values_list(
+        'author__username', 'group_id').first() or (None, None)
+    scopes = [f'post:{post_id}', f'author:{username}']
+    if group_id is not None:
+        scopes.append(f'group-id:{group_id}')
+    return etag(request, *scopes)
+
+
+@condition(etag_func=post_detail_etag)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    comments = post.comments.all()
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), id=post_id)
+    comments = post.comments.select_related('author')
     form = CommentForm(request.POST or None)
-    author = post.author
-    post_count = author.posts.count()
+    post_count = author_stats(post.author).posts_count
     context = {
         'title': f'Пост {post.text[:30]}',
         'post': post,
@@ -69,14 +94,19 @@ def post_detail(request, post_id):
         'form': form,
         'comments': comments,
     }
-    return render(request, 'posts/post_detail.html', context)
+    response = render(request, 'posts/post_detail.html', context)
+    keys = surrogate.post_keys([post])
+    if post.group is not None:
+        keys.append(f'group-{post.group.slug}')
+    return surrogate.tag(response, *keys)
 
 
 @login_required
+@transaction.atomic
 def post_create(request):
     if request.method == 'POST':
         author = request.user
-        form = PostForm(request.POST)
+        form = PostForm(request.POST, files=request.FILES or None)
         if form.is_valid():
             new_post = form.save(commit=False)
             new_post.author = author
@@ -90,6 +120,7 @@ def post_create(request):
 
 
 @login_required
+@transaction.atomic
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     if post.author != request.user:
@@ -108,6 +139,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     # Получите пост
     post = get_object_or_404(Post, id=post_id)
@@ -122,14 +154,50 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.select_related('group').filter(
-        author__following__user=request.user)
-    context = page_context(request, posts)
-    context.update(posts=posts)
-    return render(request, 'posts/follow.html', context)
+    context = follow_page_context(request)
+    images.attach_variants(context['page_obj'])
+    response = render(request, 'posts/follow.html', context)
+    # Лента своя у каждого читателя, и её меняют подписки и посты
+    # чужих авторов, поэтому в общем кэше прокси ей не место.
+    patch_cache_control(response, private=True)
+    return response
+
+
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    posts, next_cursor = search.search(
+        query,
+        after=request.GET.get('after'),
+        limit=settings.PAGINATOR_POST_COUNT,
+    )
+    images.attach_variants(posts)
+    context = {
+        'query': query,
+        'posts': posts,
+        'next_cursor': next_cursor,
+    }
+    response = render(request, 'posts/search.html', context)
+    return surrogate.tag(response, 'feed', *surrogate.post_keys(posts))
+
+
+def resize_image(request, signature, width, height, path):
+    if (not resize.is_valid(signature, width, height, path)
+            or min(width, height) < 1
+            or max(width, height) > settings.RESIZE_MAX_SIDE):
+        raise Http404
+    try:
+        file = resize.open_resized(width, height, path)
+    except (OSError, SuspiciousFileOperation):
+        raise Http404
+    response = FileResponse(file, content_type='image/jpeg')
+    patch_cache_control(
+        response, public=True, max_age=settings.RESIZE_MAX_AGE,
+        immutable=True)
+    return response
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author:
@@ -138,6 +206,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     Follow.objects.filter(
         user=request.user, author__username=username
@@ -58,6 +58,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'posts.queries.QueryBudgetMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
@@ -142,12 +143,91 @@ LOGIN_REDIRECT_URL = 'posts:index'
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 PAGINATOR_POST_COUNT = 10
+# Выборки до этого размера пагинатор считает точно, большие - из кэша
+PAGINATOR_EXACT_COUNT_LIMIT = 1000
+PAGINATOR_COUNT_TIMEOUT = 5 * 60
+TIMELINE_BATCH_SIZE = 500
+# 'timeline' - fan-out on write, 'merge' - слияние списков авторов при чтении
+FOLLOW_FEED = 'timeline'
+FEED_RECENT_POSTS = 200
+# Страницы лент инвалидируются сигналами, поэтому могут жить долго -
+# но только с общим для всех процессов кэшем, см. CACHES
+PAGE_CACHE_TIMEOUT = 60 if DEBUG else 60 * 60
+# Отрендеренные карточки постов; ключ меняется вместе с версиями
+CARD_CACHE_TIMEOUT = 24 * 60 * 60
+# Нарезки картинок постов: алиас -> (ширина, высота), обрезка по центру
+POST_IMAGE_VARIANTS = {
+    'card': (960, 339),
+}
+POST_IMAGE_QUALITY = 85
+# Размер размытой заглушки, которая видна, пока грузится картинка;
+# пропорции как у варианта card
+POST_IMAGE_PLACEHOLDER_SIZE = (28, 10)
+# Загрузки уменьшаются до этой стороны и перекодируются в первый
+# доступный формат; больше POST_IMAGE_MAX_PIXELS не принимаем вовсе
+POST_IMAGE_MAX_SIDE = 2048
+POST_IMAGE_MAX_PIXELS = 50_000_000
+POST_IMAGE_FORMATS = ('WEBP', 'JPEG')
+# 0 - нарезать сразу после коммита, без фонового пула; так проще
+# в отладке и в тестах, где файлы не должны появляться после ответа
+POST_IMAGE_WORKERS = 0 if DEBUG else 2
+# Дисковый кэш ресайза по подписанным ссылкам /media/resize/...
+RESIZE_CACHE_ROOT = os.path.join(BASE_DIR, 'resize_cache')
+RESIZE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+RESIZE_MAX_SIDE = 2048
+RESIZE_MAX_AGE = 365 * 24 * 60 * 60
+# HTTP-кэш перед сайтом: ответы помечаются surrogate-ключами, а сигналы
+# сбрасывают их через PURGE_BACKEND (HttpPurgeBackend шлёт на PURGE_URL)
+SURROGATE_KEY_HEADER = 'Surrogate-Key'
+EDGE_CACHE_TIMEOUT = 6 * 60 * 60
+PURGE_BACKEND = 'posts.surrogate.LocalPurgeBackend'
+PURGE_URL = None
+PURGE_METHOD = 'PURGE'
+PURGE_TIMEOUT = 5
+# Бюджет запросов к базе на страницу по имени URL (None - без бюджета);
+# превышение - ошибка, а без QUERY_BUDGET_STRICT - запись в лог. Один
+# и тот же SQL, выполненный за запрос N_PLUS_ONE_THRESHOLD раз и больше
+# (не обязательно подряд), пишется в лог как N+1. Запись ищет строку
+# шаблона по стеку на каждый SQL, поэтому включена только при отладке
+# и в тестах
+QUERY_BUDGET_ENABLED = DEBUG
+QUERY_BUDGET_STRICT = DEBUG
+QUERY_BUDGET_DEFAULT = None
+QUERY_BUDGETS = {
+    'posts:index': 6,
+    'posts:group_posts': 6,
+    'posts:profile': 8,
+    'posts:post_detail': 8,
+    'posts:follow_index': 8,
+    'posts:search': 6,
+}
+N_PLUS_ONE_THRESHOLD = 3
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Версии областей кэша должны быть общими для всех процессов сервера,
+# иначе сигнал сбросит страницы только в своём. В бою кэш лежит в своей
+# базе SQLite (таблицу создаёт manage.py createcachetable --database
+# cache), при отладке хватает памяти процесса. Запас записей большой,
+# чтобы вытеснение не уносило версии и списки лент вместе со страницами.
+if DEBUG:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10_000},
+        }
+    }
+else:
+    DATABASES['cache'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'cache.sqlite3'),
+    }
+    DATABASE_ROUTERS = ['core.routers.CacheRouter']
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'yatube_cache',
+            'OPTIONS': {'MAX_ENTRIES': 100_000},
+        }
     }
-}